@@ -1,4 +1,4 @@
 # __init__.py
-from .minhash import KMinHash, UniMinHash
-from ._data_structures import DictionaryArray
+from .minhash import KMinHash, OPHMinHash, UniMinHash
+from ._data_structures import DictionaryArray, FrozenDictionaryArray
 from .lsh import LSH
@@ -1,3 +1,10 @@
+import sys
+
+import numpy as np
+
+_EMPTY_BUCKET = frozenset()
+_EMPTY_VALUES = np.empty(0, dtype=np.int64)
+
 
 class DictionaryArray:
     """ Instantiates object containing an array of n dictionaries.
@@ -43,6 +50,23 @@ class DictionaryArray:
             if not self._hash_arrays[array_id].get(key):
                 self._hash_arrays[array_id][key] = set()
 
+    def update_many(self, array_id, keys, values):
+        """ Adds each value to the set of its key in specified dictionary.
+
+        Args:
+            array_id (int): Location of dictionary to update.
+            keys (list): Dictionary key for each value.
+            values (list): Values to add to the set of each key.
+
+        """
+        array = self._hash_arrays[array_id]
+        for key, value in zip(keys, values):
+            bucket = array.get(key)
+            if bucket:
+                bucket.add(value)
+            else:
+                array[key] = {value}
+
     def get(self, array_id, key):
         """ Retrieve set of values for specified dictionary and key.
 
@@ -56,6 +80,69 @@ class DictionaryArray:
         """
         return self._hash_arrays[array_id][key]
 
+    def get_many(self, array_id, keys):
+        """ Retrieve sets of values for many keys of a specified dictionary.
+
+        Missing keys return an empty set rather than raising a KeyError.
+
+        Args:
+            array_id (int): Location of dictionary to retrieve keys from.
+            keys (list): Dictionary keys for specified dictionary.
+
+        Returns:
+            list: Set of unique values for each key.
+
+        """
+        array = self._hash_arrays[array_id]
+        return [array.get(key, _EMPTY_BUCKET) for key in keys]
+
+    def items(self, array_id):
+        """ Iterates over keys and sets of values of specified dictionary.
+
+        Args:
+            array_id (int): Location of dictionary to iterate over.
+
+        Returns:
+            iterator: Key, set of values pairs.
+
+        """
+        return iter(self._hash_arrays[array_id].items())
+
+    def key_sizes(self, array_id):
+        """ Returns the number of values held by each key of a dictionary.
+
+        Args:
+            array_id (int): Location of dictionary to size.
+
+        Returns:
+            tuple: Array of keys and array of their set sizes.
+
+        """
+        array = self._hash_arrays[array_id]
+        keys = np.fromiter(array.keys(), dtype=np.int64, count=len(array))
+        sizes = np.fromiter(map(len, array.values()), dtype=np.int64, count=len(array))
+        return keys, sizes
+
+    def nbytes(self):
+        """ Approximate memory used by the dictionaries, sets and values.
+
+        Values shared between dictionaries are counted once.
+
+        Returns:
+            int: Size in bytes.
+
+        """
+        total = sys.getsizeof(self._hash_arrays)
+        values = {}
+        for array in self._hash_arrays:
+            total += sys.getsizeof(array)
+            for key, bucket in array.items():
+                total += sys.getsizeof(key) + sys.getsizeof(bucket)
+                for value in bucket:
+                    values[id(value)] = value
+
+        return total + sum(map(sys.getsizeof, values.values()))
+
     def remove_key(self, array_id, key):
         """ Key to delete from specified dictionary.
 
@@ -85,6 +172,25 @@ class DictionaryArray:
         if not bucket:
             del self._hash_arrays[array_id][key]
 
+    def remove_many(self, array_id, keys, values):
+        """ Removes each value from the set of its key in specified dictionary.
+
+        Empty dictionary keys are deleted.
+
+        Args:
+            array_id (int): Location of dictionary to remove values from.
+            keys (list): Dictionary key for each value.
+            values (list): Values to remove from the set of each key.
+
+        """
+        array = self._hash_arrays[array_id]
+        for key, value in zip(keys, values):
+            bucket = array[key]
+            bucket.remove(value)
+
+            if not bucket:
+                del array[key]
+
     def values(self):
         """ Returns unique values from dictionaries.
         
@@ -98,3 +204,380 @@ class DictionaryArray:
                 values.update(value_set)
 
         return values
+
+
+class FrozenDictionaryArray:
+    """ Compressed sparse row form of a DictionaryArray.
+
+    Keys of each dictionary are held as a sorted int64 array with offsets
+    into a single flat array of values, keys are looked up with
+    np.searchsorted. Arrays may be np.memmap views of files on disk.
+
+    Writes are held in a small mutable delta of added and removed values
+    until merge is called.
+
+    Attributes:
+        n_arrays (int): Number of dictionary arrays included.
+
+    """
+
+    def __init__(self, keys, array_offsets, key_offsets, values):
+        """ Wraps compressed sparse row arrays of an array of dictionaries.
+
+        Args:
+            keys (np.array): Sorted keys of each dictionary, concatenated.
+            array_offsets (np.array): Start of each dictionary in keys, with
+                a final entry of len(keys).
+            key_offsets (np.array): Start of each key's values in values,
+                with a final entry of len(values).
+            values (np.array): Values of every key, concatenated.
+
+        """
+        self.n_arrays = len(array_offsets) - 1
+        self._keys = keys
+        self._array_offsets = array_offsets
+        self._key_offsets = key_offsets
+        self._values = values
+        self._added = DictionaryArray(self.n_arrays)
+        self._removed = DictionaryArray(self.n_arrays)
+
+    @classmethod
+    def from_dictionary_array(cls, dictionary_array):
+        """ Compacts a DictionaryArray of integer keys and values.
+
+        Values are stored as int32 where they fit, otherwise int64.
+
+        Args:
+            dictionary_array (DictionaryArray): Array of dictionaries to
+                compact.
+
+        Returns:
+            FrozenDictionaryArray: Compacted array of dictionaries.
+
+        """
+        keys = []
+        sizes = []
+        values = []
+        array_offsets = [0]
+        for array_id in range(dictionary_array.n_arrays):
+            for key, value_set in sorted(dictionary_array.items(array_id)):
+                if not value_set:
+                    continue
+
+                keys.append(key)
+                sizes.append(len(value_set))
+                values.extend(sorted(value_set))
+
+            array_offsets.append(len(keys))
+
+        values = np.array(values, dtype=np.int64)
+        if len(values) and values.max() < np.iinfo(np.int32).max:
+            values = values.astype(np.int32)
+
+        return cls(
+            np.array(keys, dtype=np.int64),
+            np.array(array_offsets, dtype=np.int64),
+            np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]),
+            values
+        )
+
+    def to_dictionary_array(self):
+        """ Expands to a mutable DictionaryArray, including pending writes.
+
+        Returns:
+            DictionaryArray: Array of dictionaries with sets of values.
+
+        """
+        dictionary_array = DictionaryArray(self.n_arrays)
+        for array_id in range(self.n_arrays):
+            dictionary_array._hash_arrays[array_id] = {
+                key: set(value_array.tolist())
+                for key, value_array in self.items(array_id)
+            }
+
+        return dictionary_array
+
+    @property
+    def pending(self):
+        """ Whether writes are held in the delta awaiting merge.
+
+        Returns:
+            bool: True if there are unmerged writes.
+
+        """
+        return any(self._added._hash_arrays) or any(self._removed._hash_arrays)
+
+    def merge(self):
+        """ Merges pending writes into the compressed sparse row arrays.
+
+        """
+        if not self.pending:
+            return
+
+        merged = self.from_dictionary_array(self.to_dictionary_array())
+        self.__dict__.update(merged.__dict__)
+
+    def _key_range(self, array_id):
+        """ Returns start and end of specified dictionary in keys.
+
+        Args:
+            array_id (int): Location of dictionary.
+
+        Returns:
+            tuple: Start and end positions.
+
+        """
+        return (
+            int(self._array_offsets[array_id]),
+            int(self._array_offsets[array_id + 1])
+        )
+
+    def _frozen_get_many(self, array_id, keys):
+        """ Retrieve arrays of values for keys, ignoring pending writes.
+
+        Args:
+            array_id (int): Location of dictionary to retrieve keys from.
+            keys (list): Dictionary keys for specified dictionary.
+
+        Returns:
+            list: Array of unique values for each key.
+
+        """
+        start, end = self._key_range(array_id)
+        array_keys = self._keys[start:end]
+        keys = np.asarray(keys, dtype=np.int64)
+
+        positions = np.searchsorted(array_keys, keys)
+        found = positions < len(array_keys)
+        found[found] = array_keys[positions[found]] == keys[found]
+        positions += start
+
+        buckets = []
+        for position, is_found in zip(positions.tolist(), found.tolist()):
+            if is_found:
+                buckets.append(
+                    self._values[
+                        self._key_offsets[position]:self._key_offsets[position + 1]
+                    ]
+                )
+            else:
+                buckets.append(_EMPTY_VALUES)
+
+        return buckets
+
+    def update(self, array_id, key, value):
+        """ Adds value to the set of specified dictionary key.
+
+        Args:
+            array_id (int): Location of dictionary to update.
+            key: Dictionary key for specified dictionary.
+            value: Value to add to set in specified dictionary key.
+
+        """
+        removed = self._removed._hash_arrays[array_id].get(key)
+        if removed and value in removed:
+            self._removed.remove_value(array_id, key, value)
+        elif value not in self._frozen_get_many(array_id, [key])[0]:
+            self._added.update(array_id, key, value)
+
+    def update_many(self, array_id, keys, values):
+        """ Adds each value to the set of its key in specified dictionary.
+
+        Args:
+            array_id (int): Location of dictionary to update.
+            keys (list): Dictionary key for each value.
+            values (list): Values to add to the set of each key.
+
+        """
+        removed = self._removed._hash_arrays[array_id]
+        added = self._added._hash_arrays[array_id]
+        frozen_buckets = self._frozen_get_many(array_id, keys)
+
+        for key, value, frozen_bucket in zip(keys, values, frozen_buckets):
+            removed_bucket = removed.get(key)
+            if removed_bucket and value in removed_bucket:
+                self._removed.remove_value(array_id, key, value)
+            elif value not in frozen_bucket:
+                added.setdefault(key, set()).add(value)
+
+    def remove_value(self, array_id, key, value):
+        """ Removes value from specified dictionary key.
+
+        Args:
+            array_id (int): Location of dictionary to remove value from.
+            key: Dictionary key for specified dictionary.
+            value: Value to remove from set in specified dictionary.
+
+        """
+        added = self._added._hash_arrays[array_id].get(key)
+        if added and value in added:
+            self._added.remove_value(array_id, key, value)
+        elif value in self._frozen_get_many(array_id, [key])[0]:
+            self._removed.update(array_id, key, value)
+        else:
+            raise KeyError(value)
+
+    def remove_many(self, array_id, keys, values):
+        """ Removes each value from the set of its key in specified dictionary.
+
+        Args:
+            array_id (int): Location of dictionary to remove values from.
+            keys (list): Dictionary key for each value.
+            values (list): Values to remove from the set of each key.
+
+        """
+        added = self._added._hash_arrays[array_id]
+        frozen_buckets = self._frozen_get_many(array_id, keys)
+
+        for key, value, frozen_bucket in zip(keys, values, frozen_buckets):
+            added_bucket = added.get(key)
+            if added_bucket and value in added_bucket:
+                self._added.remove_value(array_id, key, value)
+            elif value in frozen_bucket:
+                self._removed.update(array_id, key, value)
+            else:
+                raise KeyError(value)
+
+    def get(self, array_id, key):
+        """ Retrieve array of values for specified dictionary and key.
+
+        Args:
+            array_id (int): Location of dictionary to retrieve key from.
+            key: Dictionary key for specified dictionary.
+
+        Returns:
+            np.array: Unique values.
+
+        """
+        values = self.get_many(array_id, [key])[0]
+        if not len(values):
+            raise KeyError(key)
+
+        return values
+
+    def get_many(self, array_id, keys):
+        """ Retrieve arrays of values for many keys of a specified dictionary.
+
+        Missing keys return an empty array rather than raising a KeyError.
+
+        Args:
+            array_id (int): Location of dictionary to retrieve keys from.
+            keys (list): Dictionary keys for specified dictionary.
+
+        Returns:
+            list: Array of unique values for each key.
+
+        """
+        buckets = self._frozen_get_many(array_id, keys)
+
+        added = self._added._hash_arrays[array_id]
+        removed = self._removed._hash_arrays[array_id]
+        if not (added or removed):
+            return buckets
+
+        for position, key in enumerate(keys):
+            if key in removed:
+                bucket = buckets[position]
+                buckets[position] = bucket[
+                    ~np.isin(bucket, list(removed[key]))
+                ]
+
+            if key in added:
+                buckets[position] = np.concatenate([
+                    buckets[position],
+                    np.fromiter(added[key], dtype=np.int64)
+                ])
+
+        return buckets
+
+    def items(self, array_id):
+        """ Iterates over keys and arrays of values of specified dictionary.
+
+        Args:
+            array_id (int): Location of dictionary to iterate over.
+
+        Yields:
+            tuple: Key, array of values pairs.
+
+        """
+        start, end = self._key_range(array_id)
+        keys = self._keys[start:end].tolist()
+
+        added = self._added._hash_arrays[array_id]
+        if added or self._removed._hash_arrays[array_id]:
+            frozen_keys = set(keys)
+            keys.extend(key for key in added if key not in frozen_keys)
+            for key, values in zip(keys, self.get_many(array_id, keys)):
+                if len(values):
+                    yield key, values
+
+            return
+
+        key_offsets = self._key_offsets[start:end + 1].tolist()
+        for position, key in enumerate(keys):
+            yield key, self._values[key_offsets[position]:key_offsets[position + 1]]
+
+    def key_sizes(self, array_id):
+        """ Returns the number of values held by each key of a dictionary.
+
+        Args:
+            array_id (int): Location of dictionary to size.
+
+        Returns:
+            tuple: Array of keys and array of their value counts.
+
+        """
+        if self._added._hash_arrays[array_id] or self._removed._hash_arrays[array_id]:
+            items = list(self.items(array_id))
+            keys = np.array([key for key, _ in items], dtype=np.int64)
+            sizes = np.array([len(values) for _, values in items], dtype=np.int64)
+            return keys, sizes
+
+        start, end = self._key_range(array_id)
+        keys = np.asarray(self._keys[start:end], dtype=np.int64)
+        sizes = np.diff(np.asarray(self._key_offsets[start:end + 1], dtype=np.int64))
+        return keys, sizes
+
+    def nbytes(self):
+        """ Memory used by the compressed arrays and the pending delta.
+
+        Returns:
+            int: Size in bytes.
+
+        """
+        return (
+            sum(array.nbytes for array in self.arrays().values())
+            + self._added.nbytes()
+            + self._removed.nbytes()
+        )
+
+    def values(self):
+        """ Returns unique values from dictionaries.
+
+        Returns:
+            set: Set of all values in dictionary arrays.
+
+        """
+        if not self.pending:
+            return set(np.unique(self._values).tolist())
+
+        values = set()
+        for array_id in range(self.n_arrays):
+            for _, value_array in self.items(array_id):
+                values.update(value_array.tolist())
+
+        return values
+
+    def arrays(self):
+        """ Returns the compressed sparse row arrays, excluding pending writes.
+
+        Returns:
+            dict: Keys, array offsets, key offsets and values arrays.
+
+        """
+        return {
+            'keys': self._keys,
+            'array_offsets': self._array_offsets,
+            'key_offsets': self._key_offsets,
+            'values': self._values,
+        }
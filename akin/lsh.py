@@ -1,21 +1,312 @@
+import itertools
+import json
 import math
+import multiprocessing
+import os
+import sys
+import time
+from collections.abc import Hashable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import mmh3
+import numpy as np
 from tqdm import tqdm
 
-from akin import DictionaryArray
+from akin import DictionaryArray, FrozenDictionaryArray
+
+_FORMAT_VERSION = 1
+_QUERY_BATCH_SIZE = 1000
+_TOP_K_CHUNK_SIZE = 256
+_PAIR_PARTITION_SIZE = 10000000
+_B_BIT_DTYPES = {8: np.uint8, 16: np.uint16, 32: np.uint32}
+
+# Model shared with forked adjacency list workers, inherited copy-on-write.
+_SHARED_LSH = None
+
+_UINT64_MASK = (1 << 64) - 1
+_C1 = np.uint64(0x87c37b91114253d5)
+_C2 = np.uint64(0x4cf5ad432745937f)
+_FMIX1 = np.uint64(0xff51afd7ed558ccd)
+_FMIX2 = np.uint64(0xc4ceb9fe1a85ec53)
+
+
+def _adjacency_shard(rows, min_jaccard, sensitivity):
+    """ Queries a shard of store rows against the shared LSH model.
+
+    Args:
+        rows (np.array): Store rows to return near duplicates for.
+        min_jaccard (float): Minimum Jaccard Similarity for texts to be
+            returned as near duplicates.
+        sensitivity (int): Number of unique buckets two ids must co-occur
+            in to be considered a near duplicate pair.
+
+    Returns:
+        tuple: Query id and store row arrays of near duplicates.
+
+    """
+    query_ids, candidate_rows, _ = _SHARED_LSH._query_batch_rows(
+        _SHARED_LSH._signatures[rows], rows, min_jaccard, sensitivity
+    )
+
+    return query_ids, candidate_rows
+
+
+def _bucket_rows(bucket):
+    """ Returns the store rows held in a bucket as an int64 array.
+
+    Args:
+        bucket (set or np.array): Bucket from a DictionaryArray or
+            FrozenDictionaryArray.
+
+    Returns:
+        np.array: int64 store rows.
+
+    """
+    if isinstance(bucket, np.ndarray):
+        return bucket.astype(np.int64, copy=False)
+
+    return np.fromiter(bucket, dtype=np.int64, count=len(bucket))
+
+
+def _band_errors(threshold, permutations, false_positive_weight, false_negative_weight):
+    """ Weighted S-curve error of every band and row combination.
+
+    Two texts of similarity s share a bucket in at least one of b bands of
+    r rows with probability 1 - (1 - s^r)^b. The false positive area is
+    its integral below the threshold and the false negative area the
+    integral of its complement above the threshold.
+
+    Args:
+        threshold (float): Target Jaccard similarity threshold.
+        permutations (int): Number of permutations in minhash signatures.
+        false_positive_weight (float): Weight of the false positive area.
+        false_negative_weight (float): Weight of the false negative area.
+
+    Returns:
+        list: Weighted error, bands and rows of each combination, lowest
+            error first.
+
+    """
+    combinations = np.array([
+        (bands, rows)
+        for bands in range(1, permutations + 1)
+        for rows in range(1, permutations // bands + 1)
+    ])
+    bands = combinations[:, :1].astype(float)
+    rows = combinations[:, 1:].astype(float)
+
+    below = np.linspace(0, threshold, 512)
+    above = np.linspace(threshold, 1, 512)
+    false_positives = np.trapezoid(1 - (1 - below ** rows) ** bands, below, axis=1)
+    false_negatives = np.trapezoid((1 - above ** rows) ** bands, above, axis=1)
+    errors = (
+        false_positive_weight * false_positives
+        + false_negative_weight * false_negatives
+    )
+
+    return sorted(zip(errors.tolist(), *combinations.T.tolist()))
+
+
+def _rotl64(values, shift):
+    """ Rotates uint64 values left by shift bits.
+
+    Args:
+        values (np.array): uint64 values to rotate.
+        shift (int): Number of bits to rotate by.
+
+    Returns:
+        np.array: Rotated uint64 values.
+
+    """
+    return (values << np.uint64(shift)) | (values >> np.uint64(64 - shift))
+
+
+def _fmix64(values):
+    """ MurmurHash3 64 bit finalizer, forces avalanche of all bits.
+
+    Args:
+        values (np.array): uint64 values to mix.
+
+    Returns:
+        np.array: Mixed uint64 values.
+
+    """
+    values = values ^ (values >> np.uint64(33))
+    values = values * _FMIX1
+    values ^= values >> np.uint64(33)
+    values *= _FMIX2
+    values ^= values >> np.uint64(33)
+
+    return values
+
+
+def _as_uint64_words(signatures):
+    """ Reinterprets signature values as raw 64 bit words.
+
+    Integer signatures are viewed as their uint64 bit patterns, larger
+    values such as 128 bit hashes are split into low and high words.
+
+    Args:
+        signatures (np.array): 2D array of signatures.
+
+    Returns:
+        np.array: 3D uint64 array of words for each signature value.
+
+    """
+    if signatures.dtype.kind == 'i':
+        return signatures.astype(np.int64).view(np.uint64)[:, :, None]
+    elif signatures.dtype.kind == 'u':
+        return signatures.astype(np.uint64)[:, :, None]
+
+    low = (signatures & _UINT64_MASK).astype(np.uint64)
+    high = ((signatures >> 64) & _UINT64_MASK).astype(np.uint64)
+
+    return np.stack([low, high], axis=2)
+
+
+def _fits_dtype(array, dtype):
+    """ Checks every value of an integer array fits in an integer dtype.
+
+    Args:
+        array (np.array): Integer or object array of integers.
+        dtype (np.dtype): Integer dtype.
+
+    Returns:
+        bool: True if the values can be cast to dtype exactly.
+
+    """
+    if array.size == 0:
+        return True
+
+    limits = np.iinfo(dtype)
+    return int(array.min()) >= limits.min and int(array.max()) <= limits.max
+
+
+def _as_signature_array(signatures, dtype=None):
+    """ Converts minhash signatures to a 2D integer array.
+
+    Numpy converts rows mixing integers beyond the int64 range with other
+    integers to float64, losing precision. Such rows are converted exactly,
+    to dtype when given and the values fit, then int64, uint64 or objects.
+    Integer arrays are cast to dtype when their values fit.
+
+    Args:
+        signatures (list): Signatures, either a list of tuples or a 2D
+            np.array.
+        dtype (np.dtype): Preferred integer dtype, such as the signature
+            store's.
+
+    Returns:
+        np.array: Array of integer signatures.
+
+    """
+    array = np.asarray(signatures)
+    if array.dtype.kind == 'f' and not isinstance(signatures, np.ndarray):
+        array = np.array(signatures, dtype=object)
+
+    if array.dtype.kind == 'O':
+        if not all(isinstance(value, (int, np.integer)) for value in array.flat):
+            raise ValueError('Minhash signatures must be integers.')
+
+        # Numpy integers are made Python ints so out of range casts raise.
+        array = np.frompyfunc(int, 1, 1)(array)
+        for integer_dtype in [dtype, np.int64, np.uint64]:
+            if integer_dtype is None or np.dtype(integer_dtype).kind not in 'iu':
+                continue
+
+            try:
+                return array.astype(integer_dtype)
+            except OverflowError:
+                continue
+
+        return array
+
+    if array.size and array.dtype.kind not in 'iu':
+        raise ValueError('Minhash signatures must be integers.')
+
+    if (
+        dtype is not None
+        and np.dtype(dtype).kind in 'iu'
+        and array.dtype != dtype
+        and _fits_dtype(array, dtype)
+    ):
+        return array.astype(dtype)
+
+    return array
+
+
+def _hash_band_words(words, n_bands, band_size, seed):
+    """ Hashes consecutive bands of signature words with MurmurHash3 mixing.
+
+    Args:
+        words (np.array): 3D uint64 array of words for each signature value
+            of the bands.
+        n_bands (int): Number of bands.
+        band_size (int): Number of signature values in each band.
+        seed (np.uint64): Hash seed.
+
+    Returns:
+        np.array: 2D uint64 array of band hashes.
+
+    """
+    n_words = words.shape[2]
+    bands = words.reshape(len(words), n_bands, band_size * n_words)
+
+    with np.errstate(over='ignore'):
+        hashes = np.full(bands.shape[:2], seed, dtype=np.uint64)
+        for column in range(bands.shape[2]):
+            block = _rotl64(bands[:, :, column] * _C1, 31) * _C2
+            hashes = _rotl64(hashes ^ block, 27) * np.uint64(5)
+            hashes += np.uint64(0x52dce729)
+
+        hashes ^= np.uint64(band_size * n_words * 8)
+
+        return _fmix64(hashes)
 
 
 class LSH:
     """ Locality Sensitive Hashing.
 
+    Labels are interned to dense integer rows of the signature store on
+    update. Buckets, candidate counting and verification work on rows only,
+    labels are restored when results are returned.
+
     Attributes:
         permutations (int): Number of permutations used in MinHash.
         no_of_bands (int): Number of bands used in model.
         seed (int): Random seed used for hashing.
+        estimator (str): Similarity estimator used to verify candidates.
+        compact_threshold (float): Fraction of lazily removed rows that
+            triggers compaction.
+        max_bucket_size (int): Largest bucket used in full to generate
+            candidates.
+        bucket_overflow (str): Handling of buckets over max_bucket_size.
+        rows_per_band (int): Exact band width, None if bands are
+            ceil(permutations / no_of_bands) wide.
+        metrics_callback (callable): Receives per call query metrics.
+        b_bits (int): Number of low bits of each minhash value stored, None
+            for full width signatures.
+        keys (dict): Maps each label to its row in the signature store.
 
     """
 
-    def __init__(self, permutations, no_of_bands=None, seed=1):
+    def __init__(
+        self,
+        permutations,
+        no_of_bands=None,
+        seed=1,
+        estimator='set',
+        hash_version=2,
+        compact_threshold=0.25,
+        max_bucket_size=None,
+        bucket_overflow='stop',
+        rows_per_band=None,
+        threshold=None,
+        false_positive_weight=0.5,
+        false_negative_weight=0.5,
+        metrics_callback=None,
+        b_bits=None
+    ):
         """ Initialize the LSH object.
 
         Args:
@@ -23,16 +314,272 @@ class LSH:
             permutations (int): Number of permutations (hashes) in minhash
                 signature.
             seed (int): Random seed used for hashing.
+            estimator (str): Jaccard similarity estimator, must be set to
+                compare signature values as sets, suited to UniMinHash
+                bottom-k signatures, or positional to use the fraction of
+                agreeing positions, suited to KMinHash signatures.
+            hash_version (int): Band hashing scheme, 2 hashes the raw bytes of
+                each band in a single vectorized pass, 1 hashes the string
+                formatting of each band and is kept for existing models.
+            compact_threshold (float): Fraction of rows that may be lazily
+                removed tombstones before buckets are compacted.
+            max_bucket_size (int): Largest bucket used in full to generate
+                candidates, None for no limit.
+            bucket_overflow (str): Handling of buckets larger than
+                max_bucket_size, stop skips them as stop-buckets and sample
+                uses an evenly spaced sample of max_bucket_size rows.
+            rows_per_band (int): Exact width of every band, trailing
+                permutations beyond no_of_bands * rows_per_band are unused.
+                By default bands are ceil(permutations / no_of_bands) wide
+                and the last band may be shorter.
+            threshold (float): Target Jaccard similarity, bands and rows are
+                chosen to minimise the weighted false positive and false
+                negative areas of the LSH S-curve around it.
+            false_positive_weight (float): Weight of false positives when
+                choosing bands and rows for a threshold.
+            false_negative_weight (float): Weight of false negatives when
+                choosing bands and rows for a threshold.
+            metrics_callback (callable): Called with a dictionary of metrics
+                after every query and query_many call, None to disable.
+            b_bits (int): Store only the lowest 8, 16 or 32 bits of each
+                minhash value, cutting signature memory 2-8x for 64 bit
+                signatures. Requires the positional estimator, which is
+                corrected for accidental collisions of the low bits, and
+                at least 32 bits in every band as bands are hashed from the
+                truncated values. None stores full width signatures.
 
         """
+        if threshold is not None:
+            if no_of_bands is not None or rows_per_band is not None:
+                raise ValueError(
+                    'Bands and rows are chosen from the threshold, '
+                    'no_of_bands and rows_per_band must not be provided.'
+                )
+
+            if not 0 < threshold < 1:
+                raise ValueError('Threshold must be between 0 and 1.')
+
+            _, no_of_bands, rows_per_band = _band_errors(
+                threshold,
+                permutations,
+                false_positive_weight,
+                false_negative_weight
+            )[0]
+
         if no_of_bands is None:
             no_of_bands = permutations // 2
 
+        if rows_per_band is not None and no_of_bands * rows_per_band > permutations:
+            raise ValueError(
+                'no_of_bands * rows_per_band must not exceed permutations.'
+            )
+
+        if estimator not in ['set', 'positional']:
+            raise ValueError(
+                'Only "set" and "positional" estimators are supported.'
+            )
+
+        if hash_version not in [1, 2]:
+            raise ValueError('Only band hash versions 1 and 2 are supported.')
+
+        if bucket_overflow not in ['stop', 'sample']:
+            raise ValueError(
+                'Only "stop" and "sample" bucket overflows are supported.'
+            )
+
+        if max_bucket_size is not None and max_bucket_size < 1:
+            raise ValueError('Max bucket size must be an integer of 1 or greater.')
+
+        if b_bits is not None:
+            if b_bits not in _B_BIT_DTYPES:
+                raise ValueError('Only 8, 16 and 32 b_bits are supported.')
+
+            if estimator != 'positional':
+                raise ValueError(
+                    'b_bits signatures require the "positional" estimator.'
+                )
+
+            # Bands are hashed from truncated values, unrelated signatures
+            # share a band with probability 2^-(b_bits * band width).
+            band_size = rows_per_band or math.ceil(permutations / no_of_bands)
+            n_banded = no_of_bands * rows_per_band if rows_per_band else permutations
+            narrowest_band = n_banded - (math.ceil(n_banded / band_size) - 1) * band_size
+            if b_bits * narrowest_band < 32:
+                raise ValueError(
+                    'b_bits * rows per band must be at least 32 to avoid '
+                    'spurious bucket collisions, use fewer, wider bands.'
+                )
+
+        self.estimator = estimator
+        self.hash_version = hash_version
+
         self.no_of_bands = no_of_bands
         self.seed = seed
         self._buckets = DictionaryArray(no_of_bands)
+        self.rows_per_band = rows_per_band
+        self._band_size = rows_per_band or math.ceil(permutations / no_of_bands)
         self.permutations = permutations
         self.keys = {}
+        self._signatures = None
+        self._labels = []
+        self._free_rows = []
+        self._n_rows = 0
+        self.compact_threshold = compact_threshold
+        self.max_bucket_size = max_bucket_size
+        self.metrics_callback = metrics_callback
+        self.bucket_overflow = bucket_overflow
+        self.b_bits = b_bits
+        self._dead = np.zeros(0, dtype=bool)
+        self._tombstones = []
+
+    def _allocate_rows(self, signatures):
+        """ Writes signatures to free rows of the signature store.
+
+        Rows freed by remove are reused first, the store then grows by
+        doubling its capacity.
+
+        Args:
+            signatures (np.array): 2D array of signatures to store.
+
+        Returns:
+            list: Row of the signature store holding each signature.
+
+        """
+        if self._signatures is None:
+            dtype = signatures.dtype if signatures.dtype.kind in 'iu' else object
+            self._signatures = np.empty(
+                (max(len(signatures), 1024), self.permutations),
+                dtype=dtype
+            )
+        elif not np.can_cast(signatures.dtype, self._signatures.dtype):
+            # The store only holds objects when values span more than 64 bits.
+            if signatures.dtype.kind in 'iu' and _fits_dtype(
+                self._signatures[:self._n_rows], signatures.dtype
+            ):
+                self._signatures = self._signatures.astype(signatures.dtype)
+            else:
+                self._signatures = self._signatures.astype(object)
+        elif not self._signatures.flags.writeable:
+            # Memory mapped stores are read into memory on the first write.
+            self._signatures = np.array(self._signatures)
+
+        n_reused = min(len(self._free_rows), len(signatures))
+        rows = [self._free_rows.pop() for _ in range(n_reused)]
+        n_new = len(signatures) - n_reused
+        rows.extend(range(self._n_rows, self._n_rows + n_new))
+        self._n_rows += n_new
+        self._labels.extend([None] * n_new)
+
+        if self._n_rows > len(self._dead):
+            dead = np.zeros(max(self._n_rows, len(self._dead) * 2), dtype=bool)
+            dead[:len(self._dead)] = self._dead
+            self._dead = dead
+
+        if self._n_rows > len(self._signatures):
+            capacity = max(self._n_rows, len(self._signatures) * 2)
+            store = np.empty(
+                (capacity, self.permutations),
+                dtype=self._signatures.dtype
+            )
+            store[:len(self._signatures)] = self._signatures
+            self._signatures = store
+
+        self._signatures[rows] = signatures
+
+        return rows
+
+    def get_signature(self, label):
+        """ Returns the minhash signature stored for a label.
+
+        Args:
+            label: Label of text in the LSH model.
+
+        Returns:
+            np.array: Minhash signature row, a view of the signature store.
+                Only the lowest b_bits of each value are stored when set.
+
+        """
+        return self._signatures[self.keys[label]]
+
+    def _truncate(self, signatures):
+        """ Keeps the lowest b_bits of each signature value.
+
+        Band hashes are taken over truncated signatures, so stored rows can
+        be rehashed on removal and queried by label. Unrelated signatures
+        then share a band with probability 2^-(b_bits * band width), which
+        init bounds at 2^-32. Truncating already truncated signatures leaves
+        them unchanged.
+
+        Args:
+            signatures (np.array): 2D array of signatures.
+
+        Returns:
+            np.array: Signatures unchanged, or their lowest b_bits when set.
+
+        """
+        if self.b_bits is None:
+            return signatures
+
+        low_words = _as_uint64_words(signatures)[:, :, 0]
+        return low_words.astype(_B_BIT_DTYPES[self.b_bits])
+
+    def __getstate__(self):
+        """ Returns model attributes to pickle, without the metrics callback.
+
+        Returns:
+            dict: Model attributes.
+
+        """
+        state = self.__dict__.copy()
+        state['metrics_callback'] = None
+        return state
+
+    def __setstate__(self, state):
+        """ Restores a pickled LSH model.
+
+        Models pickled before signatures were held in an array store are
+        rebuilt with the version 1 band hashing scheme they were built with.
+
+        Args:
+            state (dict): Pickled model attributes.
+
+        """
+        if '_signatures' not in state:
+            self.__init__(
+                state['permutations'],
+                state['no_of_bands'],
+                state['seed'],
+                hash_version=1
+            )
+            self.update(list(state['keys'].values()), list(state['keys']))
+            return
+
+        state.setdefault('hash_version', 1)
+        state.setdefault('compact_threshold', 0.25)
+        state.setdefault('max_bucket_size', None)
+        state.setdefault('rows_per_band', None)
+        state.setdefault('metrics_callback', None)
+        state.setdefault('bucket_overflow', 'stop')
+        state.setdefault('b_bits', None)
+        state.setdefault('_dead', np.zeros(state['_n_rows'], dtype=bool))
+        state.setdefault('_tombstones', [])
+        self.__dict__.update(state)
+
+    @property
+    def _n_bands(self):
+        """ Number of bands signatures are split into.
+
+        Without rows_per_band, bands ceil(permutations / no_of_bands) wide
+        may cover every permutation in fewer than no_of_bands bands.
+
+        Returns:
+            int: Number of bands hashed for each signature.
+
+        """
+        if self.rows_per_band is not None:
+            return self.no_of_bands
+
+        return math.ceil(self.permutations / self._band_size)
 
     def _lsh(self, signature):
         """ Break signatures into bands and hash components to buckets.
@@ -40,23 +587,92 @@ class LSH:
         Args:
             signature (tuple): a minhash signature.
 
+        Returns:
+            list: Bucket id for each band.
+
         """
-        band_hashes = []
-        band_size = math.ceil(len(signature) / self.no_of_bands)
-        for i in range(0, self.permutations, band_size):
-            band = str(signature[i:i + band_size])
-            bucket_id = mmh3.hash64(band, self.seed)[0]
-            band_hashes.append(bucket_id)
+        return self._lsh_batch(np.asarray(signature)[None, :])[0].tolist()
+
+    def _lsh_batch(self, signatures):
+        """ Break a batch of signatures into bands and hash to buckets.
 
-        return band_hashes
+        Version 2 hashing folds the raw 64 bit words of each band through
+        MurmurHash3 style mixing, vectorized across all bands and signatures.
+        Version 1 hashes the string formatting of each band tuple.
+
+        Args:
+            signatures (np.array): 2D array of minhash signatures.
+
+        Returns:
+            np.array: 2D int64 array of bucket ids, one column per band.
+
+        """
+        n_banded = self.permutations
+        if self.rows_per_band is not None:
+            n_banded = self.no_of_bands * self.rows_per_band
+
+        band_starts = range(0, n_banded, self._band_size)
+
+        if self.hash_version == 1:
+            band_hashes = [
+                [
+                    mmh3.hash64(str(signature[i:i + self._band_size]), self.seed)[0]
+                    for i in band_starts
+                ]
+                for signature in map(tuple, signatures.tolist())
+            ]
+            return np.array(band_hashes, dtype=np.int64).reshape(
+                len(signatures), len(band_starts)
+            )
+
+        words = _as_uint64_words(signatures)
+
+        # Values fitting in 64 bits are hashed as a single word whatever the
+        # array dtype, so a bucket depends only on the values of its band.
+        wide = None
+        if words.shape[2] == 2:
+            wide = (
+                (signatures < -(1 << 63)) | (signatures > _UINT64_MASK)
+            ).astype(bool)
+
+        band_hashes = np.empty((len(signatures), len(band_starts)), dtype=np.uint64)
+        seed = np.uint64(self.seed & _UINT64_MASK)
+        # Full width bands are hashed together, a shorter last band alone.
+        n_full = n_banded // self._band_size
+        groups = [(0, n_full, self._band_size)]
+        if n_full < len(band_starts):
+            last_band_size = n_banded - n_full * self._band_size
+            groups.append((n_full, n_full + 1, last_band_size))
+
+        for first_band, last_band, band_size in groups:
+            start = first_band * self._band_size
+            end = start + (last_band - first_band) * band_size
+            n_bands = last_band - first_band
+
+            hashes = _hash_band_words(words[:, start:end, :1], n_bands, band_size, seed)
+            if wide is not None:
+                wide_bands = wide[:, start:end].reshape(
+                    len(signatures), n_bands, band_size
+                ).any(axis=2)
+
+                if wide_bands.any():
+                    hashes = np.where(
+                        wide_bands,
+                        _hash_band_words(words[:, start:end], n_bands, band_size, seed),
+                        hashes
+                    )
+
+            band_hashes[:, first_band:last_band] = hashes
+
+        return band_hashes.view(np.int64)
 
     @staticmethod
     def _jaccard_similarity(query_signature, candidate):
         """ Estimate jaccard similarity ratio of signatures.
 
         Args:
-            query_signature (tuple): Query minhash signature.
-            candidate (dict): Candidate signature.
+            query_signature (np.array): Query minhash signature.
+            candidate (np.array): Candidate signature.
 
         Returns:
             float: Estimated jaccard ratio.
@@ -68,110 +684,695 @@ class LSH:
 
         return jaccard_ratio
 
+    @staticmethod
+    def _n_unique(signatures):
+        """ Counts unique values in each row of a signature matrix.
+
+        Args:
+            signatures (np.array): 2D array of signatures.
+
+        Returns:
+            np.array: Number of unique values in each row.
+
+        """
+        sorted_signatures = np.sort(signatures, axis=1)
+        return 1 + (sorted_signatures[:, 1:] != sorted_signatures[:, :-1]).sum(
+            axis=1
+        )
+
+    @classmethod
+    def _batch_jaccard_similarity(cls, query_signature, candidates):
+        """ Estimate jaccard similarity ratio of signatures in a batch.
+
+        Vectorized equivalent of _jaccard_similarity, unique values are
+        counted by sorting each row, the union is counted over the
+        concatenated query and candidate rows and the intersection derived.
+
+        Args:
+            query_signature (np.array): Query minhash signature, or a 2D array
+                with one query signature per candidate.
+            candidates (np.array): 2D array of candidate signatures.
+
+        Returns:
+            np.array: Estimated jaccard ratio for each candidate.
+
+        """
+        query_signatures = np.broadcast_to(query_signature, candidates.shape)
+        if np.ndim(query_signature) == 1:
+            n_query = cls._n_unique(query_signatures[:1])
+        else:
+            n_query = cls._n_unique(query_signatures)
+
+        union = cls._n_unique(np.hstack([query_signatures, candidates]))
+        intersection = n_query + cls._n_unique(candidates) - union
+
+        return intersection / union
+
+    @staticmethod
+    def _positional_similarity(query_signature, candidates):
+        """ Estimate jaccard similarity ratio from positional agreement.
+
+        The fraction of positions where two k-permutation signatures agree is
+        an unbiased estimate of the jaccard similarity of the texts.
+
+        Args:
+            query_signature (np.array): Query minhash signature, or a 2D array
+                with one query signature per candidate.
+            candidates (np.array): 2D array of candidate signatures.
+
+        Returns:
+            np.array: Estimated jaccard ratio for each candidate.
+
+        """
+        return (candidates == query_signature).mean(axis=1)
+
+    def _estimate_similarity(self, query_signature, candidates):
+        """ Estimate jaccard similarity using the model's estimator.
+
+        Args:
+            query_signature (np.array): Query minhash signature, or a 2D array
+                with one query signature per candidate.
+            candidates (np.array): 2D array of candidate signatures.
+
+        Returns:
+            np.array: Estimated jaccard ratio for each candidate.
+
+        """
+        if self.estimator == 'positional':
+            return self._b_bit_corrected(
+                self._positional_similarity(query_signature, candidates)
+            )
+
+        return self._batch_jaccard_similarity(query_signature, candidates)
+
+    def _b_bit_corrected(self, agreement):
+        """ Corrects positional agreement of b-bit signatures.
+
+        The low b bits of two different minhash values still collide with
+        probability 2^-b, so agreement E estimates J + (1 - J) * 2^-b and
+        J is recovered as (E - 2^-b) / (1 - 2^-b).
+
+        Args:
+            agreement (np.array): Fraction of agreeing signature positions.
+
+        Returns:
+            np.array: Estimated jaccard ratio, agreement unchanged for full
+                width signatures.
+
+        """
+        if self.b_bits is None:
+            return agreement
+
+        collision = 2.0 ** -self.b_bits
+        return np.maximum((agreement - collision) / (1 - collision), 0.0)
+
+    def _resolve_queries(self, labels_or_signatures):
+        """ Resolves query labels and raw signatures to signatures.
+
+        Indexed labels are looked up in the signature store, any other item
+        of permutations length is treated as an unindexed signature.
+
+        Args:
+            labels_or_signatures (list): Labels, signatures or a 2D np.array
+                of signatures.
+
+        Returns:
+            tuple: 2D array of query signatures and the store row of each
+                query, -1 for unindexed signatures.
+
+        """
+        if (
+            isinstance(labels_or_signatures, np.ndarray)
+            and labels_or_signatures.ndim == 2
+        ):
+            if labels_or_signatures.shape[1] != self.permutations:
+                raise IndexError(
+                    'Number of permutations in minhash must be '
+                    f'{self.permutations} to match LSH model.'
+                )
+
+            return (
+                _as_signature_array(labels_or_signatures),
+                np.full(len(labels_or_signatures), -1, dtype=np.int64)
+            )
+
+        signatures = []
+        query_rows = []
+        for item in labels_or_signatures:
+            if isinstance(item, Hashable) and item in self.keys:
+                row = self.keys[item]
+                signatures.append(self._signatures[row])
+                query_rows.append(row)
+            elif (
+                isinstance(item, (np.ndarray, list, tuple))
+                and len(item) == self.permutations
+            ):
+                signatures.append(item)
+                query_rows.append(-1)
+            else:
+                raise KeyError(item)
+
+        store_dtype = None if self._signatures is None else self._signatures.dtype
+
+        return (
+            _as_signature_array(signatures, store_dtype),
+            np.asarray(query_rows, dtype=np.int64)
+        )
+
+    def _capped_bucket_rows(self, bucket):
+        """ Returns the store rows of a bucket, capped at max_bucket_size.
+
+        Oversized buckets are skipped as stop-buckets, returning no rows, or
+        sampled at evenly spaced positions of their sorted rows so the
+        sample is the same for dictionary and frozen buckets.
+
+        Args:
+            bucket (set or np.array): Store rows held by a bucket.
+
+        Returns:
+            np.array: Store rows to use as candidates.
+
+        """
+        if self.max_bucket_size is None or len(bucket) <= self.max_bucket_size:
+            return _bucket_rows(bucket)
+
+        if self.bucket_overflow == 'stop':
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.sort(_bucket_rows(bucket))
+        positions = np.linspace(0, len(rows) - 1, self.max_bucket_size)
+        return rows[positions.astype(np.int64)]
+
+    def stop_buckets(self, max_size=None):
+        """ Reports buckets holding more rows than a size limit.
+
+        Args:
+            max_size (int): Bucket size limit, defaults to max_bucket_size.
+
+        Returns:
+            list: Band id, bucket id and size of each oversized bucket,
+                largest first.
+
+        """
+        if max_size is None:
+            max_size = self.max_bucket_size
+
+        if max_size is None:
+            raise ValueError(
+                'A max_size must be provided when max_bucket_size is not set.'
+            )
+
+        oversized = []
+        for band_id in range(self.no_of_bands):
+            bucket_ids, sizes = self._buckets.key_sizes(band_id)
+            positions = np.flatnonzero(sizes > max_size)
+            oversized.extend(zip(
+                itertools.repeat(band_id),
+                bucket_ids[positions].tolist(),
+                sizes[positions].tolist()
+            ))
+
+        return sorted(oversized, key=lambda bucket: bucket[2], reverse=True)
+
+    def stats(self, n_largest=10):
+        """ Reports bucket size distributions and memory use of the model.
+
+        Args:
+            n_largest (int): Number of largest buckets to report.
+
+        Returns:
+            dict: Label, tombstone and free row counts, per band bucket
+                counts and power of two bucket size histograms, the largest
+                buckets as (band id, bucket id, size) tuples and the
+                approximate memory in bytes used by buckets, signatures and
+                labels.
+
+        """
+        bands = []
+        largest_buckets = []
+        for band_id in range(self.no_of_bands):
+            bucket_ids, sizes = self._buckets.key_sizes(band_id)
+            bucket_ids = bucket_ids[sizes > 0]
+            sizes = sizes[sizes > 0]
+
+            # Bucket sizes are binned by powers of two, keyed by lower bound.
+            bins = np.bincount(np.log2(sizes).astype(np.int64)) if len(sizes) else []
+            bands.append({
+                'buckets': len(sizes),
+                'rows': int(sizes.sum()),
+                'max_bucket_size': int(sizes.max()) if len(sizes) else 0,
+                'histogram': {
+                    2 ** exponent: int(count)
+                    for exponent, count in enumerate(bins) if count
+                },
+            })
+
+            largest = np.argsort(-sizes, kind='stable')[:n_largest]
+            largest_buckets.extend(zip(
+                itertools.repeat(band_id),
+                bucket_ids[largest].tolist(),
+                sizes[largest].tolist()
+            ))
+
+        signature_bytes = 0
+        if self._signatures is not None:
+            signature_bytes = self._signatures.nbytes
+            if self._signatures.dtype == object:
+                signature_bytes += sum(map(
+                    sys.getsizeof, self._signatures[:self._n_rows].ravel()
+                ))
+
+        return {
+            'labels': len(self.keys),
+            'tombstones': len(self._tombstones),
+            'free_rows': len(self._free_rows),
+            'bands': bands,
+            'largest_buckets': sorted(
+                largest_buckets, key=lambda bucket: bucket[2], reverse=True
+            )[:n_largest],
+            'memory': {
+                'buckets': self._buckets.nbytes(),
+                'signatures': signature_bytes,
+                'labels': sys.getsizeof(self.keys) + sys.getsizeof(self._labels),
+            },
+        }
+
+    def _candidates(self, query_signatures, query_rows, metrics=None, capped=None):
+        """ Gathers candidates and counts band co-occurrences for a batch.
+
+        Buckets for every query and band are looked up in bulk and the
+        co-occurrence of each (query, candidate) pair counted with a single
+        np.unique over the gathered rows. Candidates keep the order in which
+        they are first found for each query.
+
+        Args:
+            query_signatures (np.array): 2D array of query signatures.
+            query_rows (np.array): Store row of each query, excluded from its
+                own candidates.
+            metrics (dict): Receives bucket and candidate counts and timings
+                when provided.
+            capped (np.array): Boolean array marking each query that hit a
+                bucket over max_bucket_size, when provided.
+
+        Returns:
+            tuple: Query id, candidate row and co-occurrence count arrays,
+                grouped by query id.
+
+        """
+        if metrics is not None:
+            start = time.perf_counter()
+
+        band_hashes = self._lsh_batch(query_signatures)
+
+        if metrics is not None:
+            metrics['hash_seconds'] = time.perf_counter() - start
+            metrics['buckets_probed'] = band_hashes.size
+
+        query_chunks = []
+        row_chunks = []
+        for band_id in range(band_hashes.shape[1]):
+            buckets = self._buckets.get_many(band_id, band_hashes[:, band_id].tolist())
+            for query_id, bucket in enumerate(buckets):
+                if len(bucket):
+                    if (
+                        capped is not None
+                        and self.max_bucket_size is not None
+                        and len(bucket) > self.max_bucket_size
+                    ):
+                        capped[query_id] = True
+
+                    rows = self._capped_bucket_rows(bucket)
+                    row_chunks.append(rows)
+                    query_chunks.append(
+                        np.full(len(rows), query_id, dtype=np.int64)
+                    )
+
+        if not row_chunks:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        query_ids = np.concatenate(query_chunks)
+        rows = np.concatenate(row_chunks)
+
+        if metrics is not None:
+            metrics['buckets_hit'] = len(row_chunks)
+            metrics['rows_gathered'] = len(rows)
+
+        if self._tombstones:
+            alive = ~self._dead[rows]
+            query_ids = query_ids[alive]
+            rows = rows[alive]
+
+        pair_keys = query_ids * max(self._n_rows, 1) + rows
+        pair_keys, first_index, occurrence_counts = np.unique(
+            pair_keys, return_index=True, return_counts=True
+        )
+
+        order = np.argsort(first_index, kind='stable')
+        order = order[np.argsort(query_ids[first_index[order]], kind='stable')]
+
+        query_ids = query_ids[first_index[order]]
+        rows = rows[first_index[order]]
+        occurrence_counts = occurrence_counts[order]
+
+        not_self = rows != query_rows[query_ids]
+
+        if metrics is not None:
+            metrics['candidates'] = int(not_self.sum())
+            metrics['gather_seconds'] = (
+                time.perf_counter() - start - metrics['hash_seconds']
+            )
+
+        return query_ids[not_self], rows[not_self], occurrence_counts[not_self]
+
     def _candidate_duplicates(
             self,
-            query_signature,
-            candidates,
+            query_signatures,
+            query_ids,
+            candidate_rows,
+            occurrence_counts,
             sensitivity=1,
             jaccard_threshold=None,
-            include_similarity=False
+            include_similarity=False,
+            metrics=None
     ):
         """ Identify candidate duplicates and check Jaccard Similarity.
 
+        Candidate signatures are gathered from the signature store and
+        verified against their query signatures in a single batch.
+
+        Args:
+            query_signatures (np.array): 2D array of query signatures.
+            query_ids (np.array): Query of each candidate.
+            candidate_rows (np.array): Store row of each candidate.
+            occurrence_counts (np.array): Number of buckets each candidate
+                shares with its query.
+            sensitivity (int): Number of identical buckets two ids must occur
+                in to be considered a near duplicate pair.
+            jaccard_threshold (float): Minimum Jaccard Similarity for
+                documents to be counted as near duplicates.
+            include_similarity (bool): return similarity alongside estimated
+                near duplicates.
+            metrics (dict): Receives the number of verified candidates when
+                provided.
+
+        Returns:
+            tuple: Query id and store row arrays of near duplicates, grouped
+                by query id, and their jaccard ratios if calculated.
+
+        """
+        if sensitivity != 1:
+            keep = occurrence_counts >= sensitivity
+            query_ids = query_ids[keep]
+            candidate_rows = candidate_rows[keep]
+
+        jaccard_ratios = None
+        if (jaccard_threshold or include_similarity) and len(candidate_rows):
+            if metrics is not None:
+                metrics['candidates_verified'] += len(candidate_rows)
+
+            jaccard_ratios = self._estimate_similarity(
+                query_signatures[query_ids],
+                self._signatures[candidate_rows]
+            )
+
+            # Apply Jaccard threshold as a mask over the batch.
+            if jaccard_threshold:
+                keep = jaccard_ratios >= jaccard_threshold
+                query_ids = query_ids[keep]
+                candidate_rows = candidate_rows[keep]
+                jaccard_ratios = jaccard_ratios[keep]
+
+        return query_ids, candidate_rows, jaccard_ratios
+
+    def _top_k_candidates(
+            self,
+            query_signatures,
+            query_ids,
+            candidate_rows,
+            occurrence_counts,
+            top_k,
+            sensitivity=1,
+            jaccard_threshold=None,
+            metrics=None,
+            capped=None
+    ):
+        """ Selects the k most similar candidates of each query.
+
+        Candidates are verified in chunks in order of band co-occurrence,
+        the k best kept so far. A signature agreeing with the query in c
+        of b bands differs in at least one position of every other band, so
+        with the positional estimator no remaining candidate can exceed
+        (permutations - (b - c)) / permutations and verification stops once
+        that bound cannot beat the k-th best. Set estimates have no such
+        bound and every candidate is verified, as are the candidates of
+        queries hitting a stop or sampled bucket, whose co-occurrence counts
+        may fall short.
+
         Args:
-            query_signature (tuple): Query minhash signature.
-            candidates (dict): List of bucket ids.
+            query_signatures (np.array): 2D array of query signatures.
+            query_ids (np.array): Query of each candidate, grouped.
+            candidate_rows (np.array): Store row of each candidate.
+            occurrence_counts (np.array): Number of buckets each candidate
+                shares with its query.
+            top_k (int): Maximum number of near duplicates per query.
             sensitivity (int): Number of identical buckets two ids must occur
                 in to be considered a near duplicate pair.
             jaccard_threshold (float): Minimum Jaccard Similarity for
                 documents to be counted as near duplicates.
+            metrics (dict): Receives the number of verified candidates when
+                provided.
+            capped (np.array): Boolean array marking each query that hit a
+                bucket over max_bucket_size.
+
+        Returns:
+            tuple: Query id, store row and jaccard ratio arrays of near
+                duplicates, grouped by query id in descending similarity.
+
+        """
+        if sensitivity != 1:
+            keep = occurrence_counts >= sensitivity
+            query_ids = query_ids[keep]
+            candidate_rows = candidate_rows[keep]
+            occurrence_counts = occurrence_counts[keep]
+
+        bounds = np.searchsorted(
+            query_ids, np.arange(len(query_signatures) + 1)
+        ).tolist()
+
+        id_chunks = []
+        row_chunks = []
+        ratio_chunks = []
+        for query_id, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start == end:
+                continue
+
+            # Stable ordering keeps candidates first found first on ties.
+            order = np.argsort(-occurrence_counts[start:end], kind='stable')
+            rows = candidate_rows[start:end][order]
+            counts = occurrence_counts[start:end][order]
+
+            best_ranks = np.empty(0, dtype=np.int64)
+            best_ratios = np.empty(0)
+            bounded = self.estimator == 'positional' and not (
+                capped is not None and capped[query_id]
+            )
+            for chunk in range(0, len(rows), _TOP_K_CHUNK_SIZE):
+                if bounded:
+                    bound = self._b_bit_corrected(
+                        (self.permutations - (self._n_bands - counts[chunk]))
+                        / self.permutations
+                    )
+
+                    if jaccard_threshold and bound < jaccard_threshold:
+                        break
+
+                    if len(best_ratios) == top_k and bound <= best_ratios[-1]:
+                        break
+
+                chunk_rows = rows[chunk:chunk + _TOP_K_CHUNK_SIZE]
+                if metrics is not None:
+                    metrics['candidates_verified'] += len(chunk_rows)
+
+                ratios = self._estimate_similarity(
+                    query_signatures[query_id], self._signatures[chunk_rows]
+                )
+                ranks = np.arange(chunk, chunk + len(chunk_rows))
+
+                if jaccard_threshold:
+                    keep = ratios >= jaccard_threshold
+                    ratios = ratios[keep]
+                    ranks = ranks[keep]
+
+                best_ratios = np.concatenate([best_ratios, ratios])
+                best_ranks = np.concatenate([best_ranks, ranks])
+                best = np.lexsort((best_ranks, -best_ratios))[:top_k]
+                best_ratios = best_ratios[best]
+                best_ranks = best_ranks[best]
+
+            id_chunks.append(np.full(len(best_ranks), query_id, dtype=np.int64))
+            row_chunks.append(rows[best_ranks])
+            ratio_chunks.append(best_ratios)
+
+        if not id_chunks:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+
+        return (
+            np.concatenate(id_chunks),
+            np.concatenate(row_chunks),
+            np.concatenate(ratio_chunks)
+        )
+
+    def _to_labels(
+            self,
+            n_queries,
+            query_ids,
+            candidate_rows,
+            jaccard_ratios=None,
+            include_similarity=False
+    ):
+        """ Translates near duplicate store rows back to labels.
+
+        Args:
+            n_queries (int): Number of queries in the batch.
+            query_ids (np.array): Query of each near duplicate, grouped.
+            candidate_rows (np.array): Store row of each near duplicate.
+            jaccard_ratios (np.array): Jaccard ratio of each near duplicate.
             include_similarity (bool): return similarity alongside estimated
                 near duplicates.
 
         Returns:
-            list: Near duplicate document ids.
+            list: Near duplicate labels for each query.
 
         """
-        # Apply Jaccard threshold and unzip pairs.
-        if jaccard_threshold or sensitivity != 1 or include_similarity:
-            matches = []
-            for candidate, occurrence_count in candidates.items():
-                if sensitivity != 1:
-                    if occurrence_count < sensitivity:
-                        continue
-
-                if jaccard_threshold or include_similarity:
-                    jaccard_ratio = self._jaccard_similarity(
-                        query_signature,
-                        self.keys[candidate]
-                    )
-
-                    if jaccard_threshold:
-                        if jaccard_ratio < jaccard_threshold:
-                            continue
-
-                    if include_similarity:
-                        matches.append((jaccard_ratio, candidate))
-                    else:
-                        matches.append(candidate)
+        bounds = np.searchsorted(query_ids, np.arange(n_queries + 1)).tolist()
+        matches = [self._labels[row] for row in candidate_rows.tolist()]
 
-                else:
-                    matches.append(candidate)
+        if include_similarity:
+            if jaccard_ratios is None:
+                jaccard_ratios = np.empty(0)
 
-            return matches
+            matches = list(zip(jaccard_ratios.tolist(), matches))
 
-        else:
-            return list(candidates)
+        return [
+            matches[start:end] for start, end in zip(bounds[:-1], bounds[1:])
+        ]
 
     def update(self, minhash_signatures, labels):
         """ Updates LSH object with new MinHash matrix and labels.
 
+        Signatures are band hashed and inserted as a single batch, if any
+        label is rejected none of the batch is inserted.
+
         Args:
             minhash_signatures (list): new minhash signatures to add to LSH
-                object.
+                object, either a list of tuples or a 2D np.array.
+            labels (list): Unique labels for each signature.
 
         """
-        if len(minhash_signatures[0]) != self.permutations:
+        signatures = _as_signature_array(
+            minhash_signatures,
+            None if self._signatures is None else self._signatures.dtype
+        )
+        if len(signatures) == 0:
+            return
+
+        if signatures.ndim != 2 or signatures.shape[1] != self.permutations:
             raise IndexError(
                 'Number of permutations in minhash must be '
                 f'{self.permutations} to match LSH model.'
             )
 
-        for signature, label in zip(minhash_signatures, labels):
-            if self.keys.get(label):
+        # Labels may be an iterator, only those paired with a signature are
+        # consumed, as zip would.
+        labels = list(itertools.islice(labels, len(signatures)))
+        if not labels:
+            return
+
+        signatures = self._truncate(signatures[:len(labels)])
+
+        # The batch is validated as a whole so a rejected label inserts nothing.
+        seen = set()
+        for label in labels:
+            if label in self.keys or label in seen:
                 raise KeyError(
                     f'Label must be unique, however "{label}" already exists '
                     'in model.'
                 )
+            seen.add(label)
+
+        bucket_ids = self._lsh_batch(signatures)
+        rows = self._allocate_rows(signatures)
 
-            self.keys[label] = signature
-            for band_id, bucket_id in enumerate(self._lsh(signature)):
-                self._buckets.update(band_id, key=bucket_id, value=label)
+        for label, row in zip(labels, rows):
+            self.keys[label] = row
+            self._labels[row] = label
+
+        for band_id in range(bucket_ids.shape[1]):
+            self._buckets.update_many(
+                band_id, bucket_ids[:, band_id].tolist(), rows
+            )
 
-    def remove(self, labels):
+    def remove(self, labels, lazy=False):
         """ Remove label and associated text signature from model.
 
+        Removed rows are marked dead in O(1) and filtered from query
+        results, their buckets are then rebuilt in bulk by compact,
+        immediately unless lazy. Rows freed in the signature store by
+        compaction are reused by later updates.
+
         Args:
-            minhash_signatures (list): minhash signatures to remove from model.
+            labels (list): labels of texts to remove from model.
+            lazy (bool): Leave removed rows as tombstones until compact is
+                called or compact_threshold is reached.
 
         """
-        for label in labels:
-            signature = self.keys[label]
-            for band_id, bucket_id in enumerate(self._lsh(signature)):
-                self._buckets.remove_value(
-                    band_id,
-                    key=bucket_id,
-                    value=label
-                )
+        labels = list(dict.fromkeys(labels))
+        rows = [self.keys[label] for label in labels]
 
+        for label, row in zip(labels, rows):
             del self.keys[label]
+            self._labels[row] = None
+
+        self._dead[rows] = True
+        self._tombstones.extend(rows)
+
+        n_tombstones = len(self._tombstones)
+        if not lazy or (
+            n_tombstones >= self.compact_threshold * (len(self.keys) + n_tombstones)
+        ):
+            self.compact()
+
+    def compact(self):
+        """ Removes tombstoned rows from buckets in a single bulk pass.
+
+        The band hashes of every dead row are computed at once and removed
+        from each band's buckets, the rows are then freed for reuse. Frozen
+        buckets hold the removals in their delta until merged by freeze.
+
+        """
+        if not self._tombstones:
+            return
+
+        rows = np.array(self._tombstones, dtype=np.int64)
+        bucket_ids = self._lsh_batch(self._signatures[rows])
+        for band_id in range(bucket_ids.shape[1]):
+            self._buckets.remove_many(
+                band_id, bucket_ids[:, band_id].tolist(), rows.tolist()
+            )
+
+        self._dead[rows] = False
+        self._free_rows.extend(self._tombstones)
+        self._tombstones = []
 
     def query(
             self,
             label,
             min_jaccard=None,
             sensitivity=1,
-            include_similarity=False
+            include_similarity=False,
+            top_k=None
     ):
         """ Returns near duplicates from model.
 
@@ -181,46 +1382,625 @@ class LSH:
         Can be used to create a recommendation model.
 
         Args:
-            minhash_signature (tuple): minhash signature of text for which to
-                return near duplicates.
+            label: Label of text for which to return near duplicates.
             min_jaccard (float): Minimum Jaccard Similarity for texts to be
                 returned as near duplicates.
             sensitivity (int): Number of unique buckets two ids must co-occur
                 in to be considered a near duplicate pair.
             include_similarity (bool): return similarity alongside estimated
                 near duplicates.
+            top_k (int): Return only the k most similar near duplicates,
+                in descending order of similarity.
 
         Returns:
             list: Candidate duplicates for provided text label.
 
         """
-        if sensitivity > self.no_of_bands:
+        if sensitivity > self._n_bands:
             raise ValueError('Sensitivity must be <= no of bands.')
 
-        candidates_dict = {}
-        minhash_signature = self.keys[label]
-        for band_id, bucket_id in enumerate(self._lsh(minhash_signature)):
-            candidates = self._buckets.get(band_id, bucket_id)
-            for candidate in candidates:
-                existing_key = candidates_dict.get(candidate)
+        row = self.keys[label]
 
-                if existing_key:
-                    existing_key += 1
-                else:
-                    candidates_dict[candidate] = 1
+        return self._query_batch(
+            self._signatures[[row]],
+            np.array([row]),
+            min_jaccard,
+            sensitivity,
+            include_similarity,
+            top_k
+        )[0]
+
+    def query_many(
+            self,
+            labels_or_signatures,
+            min_jaccard=None,
+            sensitivity=1,
+            include_similarity=False,
+            top_k=None
+    ):
+        """ Returns near duplicates from model for a batch of queries.
+
+        Queries may be labels of texts in the model or minhash signatures of
+        texts that have not been added to the model. The whole batch is band
+        hashed, looked up and counted at once.
+
+        Args:
+            labels_or_signatures (list): Labels of texts in the model, minhash
+                signatures or a 2D np.array of minhash signatures.
+            min_jaccard (float): Minimum Jaccard Similarity for texts to be
+                returned as near duplicates.
+            sensitivity (int): Number of unique buckets two ids must co-occur
+                in to be considered a near duplicate pair.
+            include_similarity (bool): return similarity alongside estimated
+                near duplicates.
+            top_k (int): Return only the k most similar near duplicates of
+                each query, in descending order of similarity.
+
+        Returns:
+            list: Candidate duplicates for each query, in query order.
 
-        del candidates_dict[label]
+        """
+        if sensitivity > self._n_bands:
+            raise ValueError('Sensitivity must be <= no of bands.')
+
+        query_signatures, query_rows = self._resolve_queries(
+            labels_or_signatures
+        )
+        query_signatures = self._truncate(query_signatures)
 
-        near_duplicates = self._candidate_duplicates(
-            minhash_signature,
-            candidates_dict,
+        return self._query_batch(
+            query_signatures,
+            query_rows,
+            min_jaccard,
             sensitivity,
+            include_similarity,
+            top_k
+        )
+
+    def _query_batch(
+            self,
+            query_signatures,
+            query_rows,
+            min_jaccard=None,
+            sensitivity=1,
+            include_similarity=False,
+            top_k=None
+    ):
+        """ Returns near duplicates for a batch of query signatures.
+
+        Args:
+            query_signatures (np.array): 2D array of query signatures.
+            query_rows (np.array): Store row of each query, -1 for unindexed
+                signatures.
+            min_jaccard (float): Minimum Jaccard Similarity for texts to be
+                returned as near duplicates.
+            sensitivity (int): Number of unique buckets two ids must co-occur
+                in to be considered a near duplicate pair.
+            include_similarity (bool): return similarity alongside estimated
+                near duplicates.
+            top_k (int): Maximum number of near duplicates per query.
+
+        Returns:
+            list: Candidate duplicates for each query.
+
+        """
+        if self.metrics_callback is None:
+            return self._to_labels(
+                len(query_signatures),
+                *self._query_batch_rows(
+                    query_signatures,
+                    query_rows,
+                    min_jaccard,
+                    sensitivity,
+                    include_similarity,
+                    top_k
+                ),
+                include_similarity
+            )
+
+        start = time.perf_counter()
+        metrics = dict.fromkeys(
+            [
+                'buckets_probed', 'buckets_hit', 'rows_gathered',
+                'candidates', 'candidates_verified'
+            ],
+            0
+        )
+        metrics.update(dict.fromkeys(
+            ['hash_seconds', 'gather_seconds', 'verify_seconds'], 0.0
+        ))
+
+        query_ids, candidate_rows, jaccard_ratios = self._query_batch_rows(
+            query_signatures,
+            query_rows,
             min_jaccard,
+            sensitivity,
+            include_similarity,
+            top_k,
+            metrics
+        )
+        near_duplicates = self._to_labels(
+            len(query_signatures),
+            query_ids,
+            candidate_rows,
+            jaccard_ratios,
             include_similarity
         )
 
+        metrics['queries'] = len(query_signatures)
+        metrics['near_duplicates'] = len(candidate_rows)
+        metrics['total_seconds'] = time.perf_counter() - start
+        self.metrics_callback(metrics)
+
+        return near_duplicates
+
+    def _query_batch_rows(
+            self,
+            query_signatures,
+            query_rows,
+            min_jaccard=None,
+            sensitivity=1,
+            include_similarity=False,
+            top_k=None,
+            metrics=None
+    ):
+        """ Returns near duplicate store rows for a batch of query signatures.
+
+        Args:
+            query_signatures (np.array): 2D array of query signatures.
+            query_rows (np.array): Store row of each query, -1 for unindexed
+                signatures.
+            min_jaccard (float): Minimum Jaccard Similarity for texts to be
+                returned as near duplicates.
+            sensitivity (int): Number of unique buckets two ids must co-occur
+                in to be considered a near duplicate pair.
+            include_similarity (bool): calculate similarity of near
+                duplicates.
+            top_k (int): Maximum number of near duplicates per query.
+            metrics (dict): Receives bucket and candidate counts and timings
+                when provided.
+
+        Returns:
+            tuple: Query id and store row arrays of near duplicates, and their
+                jaccard ratios if calculated.
+
+        """
+        if top_k is not None and top_k < 1:
+            raise ValueError('top_k must be an integer of 1 or greater.')
+
+        if len(query_signatures) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, None
+
+        capped = np.zeros(len(query_signatures), dtype=bool)
+        query_ids, candidate_rows, occurrence_counts = self._candidates(
+            query_signatures, query_rows, metrics, capped
+        )
+
+        if metrics is not None:
+            start = time.perf_counter()
+
+        if top_k is not None:
+            near_duplicates = self._top_k_candidates(
+                query_signatures,
+                query_ids,
+                candidate_rows,
+                occurrence_counts,
+                top_k,
+                sensitivity,
+                min_jaccard,
+                metrics,
+                capped
+            )
+        else:
+            near_duplicates = self._candidate_duplicates(
+                query_signatures,
+                query_ids,
+                candidate_rows,
+                occurrence_counts,
+                sensitivity,
+                min_jaccard,
+                include_similarity,
+                metrics
+            )
+
+        if metrics is not None:
+            metrics['verify_seconds'] = time.perf_counter() - start
+
         return near_duplicates
 
+    def _candidate_pair_rows(self, sensitivity=1, max_pairs=_PAIR_PARTITION_SIZE):
+        """ Finds unique candidate pairs, one partition of first rows at a time.
+
+        Live rows of every bucket holding two or more are gathered sorted
+        into one array, from which the number of pairs led by each row is
+        known. First rows are split into consecutive ranges leading at most
+        max_pairs pairs within buckets, so memory is bounded by max_pairs
+        pair keys, or the pairs of a single row where that is larger, rather
+        than the pairs of every bucket at once. Pairs of each range are
+        encoded as a single integer and counted across bands with np.unique,
+        so each pair is found once however many buckets it shares.
+
+        Args:
+            sensitivity (int): Number of unique buckets two ids must co-occur
+                in to be considered a candidate pair.
+            max_pairs (int): Maximum number of pairs within buckets generated
+                at a time.
+
+        Yields:
+            tuple: Arrays of first and second store rows of each pair in a
+                partition, the first row is always the smaller. Pairs are
+                ordered by first then second row across partitions.
+
+        """
+        n_rows = max(self._n_rows, 1)
+        bucket_chunks = []
+        for band_id in range(self.no_of_bands):
+            for _, bucket in self._buckets.items(band_id):
+                if len(bucket) < 2:
+                    continue
+
+                rows = np.sort(self._capped_bucket_rows(bucket))
+                if self._tombstones:
+                    rows = rows[~self._dead[rows]]
+                if len(rows) > 1:
+                    bucket_chunks.append(rows)
+
+        if not bucket_chunks:
+            return
+
+        bucket_rows = np.concatenate(bucket_chunks)
+        bucket_ends = np.repeat(
+            np.cumsum([len(rows) for rows in bucket_chunks]),
+            [len(rows) for rows in bucket_chunks]
+        )
+        del bucket_chunks
+
+        # Each row leads a pair with every later row of its bucket.
+        n_led = bucket_ends - np.arange(len(bucket_rows)) - 1
+        pairs_led = np.cumsum(np.bincount(bucket_rows, weights=n_led, minlength=n_rows))
+
+        first_row = 0
+        while first_row < n_rows:
+            pairs_before = pairs_led[first_row - 1] if first_row else 0
+            end_row = max(
+                int(np.searchsorted(pairs_led, pairs_before + max_pairs, side='right')),
+                first_row + 1
+            )
+
+            positions = np.flatnonzero(
+                (bucket_rows >= first_row) & (bucket_rows < end_row) & (n_led > 0)
+            )
+            first_row = end_row
+            if not len(positions):
+                continue
+
+            counts = n_led[positions]
+            group_starts = np.cumsum(counts) - counts
+            later = (
+                np.arange(counts.sum())
+                - np.repeat(group_starts, counts)
+                + np.repeat(positions + 1, counts)
+            )
+            pair_keys, occurrence_counts = np.unique(
+                np.repeat(bucket_rows[positions], counts) * n_rows
+                + bucket_rows[later],
+                return_counts=True
+            )
+            if sensitivity != 1:
+                pair_keys = pair_keys[occurrence_counts >= sensitivity]
+
+            if len(pair_keys):
+                yield pair_keys // n_rows, pair_keys % n_rows
+
+    def candidate_pairs(self, sensitivity=1):
+        """ Yields each unique candidate pair of labels in the model once.
+
+        Args:
+            sensitivity (int): Number of unique buckets two ids must co-occur
+                in to be considered a candidate pair.
+
+        Yields:
+            tuple: Pair of labels.
+
+        """
+        if sensitivity > self._n_bands:
+            raise ValueError('Sensitivity must be <= no of bands.')
+
+        for first_rows, second_rows in self._candidate_pair_rows(sensitivity):
+            for first_row, second_row in zip(
+                first_rows.tolist(), second_rows.tolist()
+            ):
+                yield self._labels[first_row], self._labels[second_row]
+
+    def near_duplicate_pairs(
+        self,
+        min_jaccard=None,
+        sensitivity=1,
+        include_similarity=False,
+        batch_size=100000
+    ):
+        """ Yields each unique near duplicate pair of labels in the model once.
+
+        Unlike adjacency_list, buckets are walked once rather than once per
+        member and each pair is verified once rather than from both sides,
+        pairs can be written straight to disk as edges of a similarity graph.
+
+        Args:
+            min_jaccard (float): Minimum Jaccard Similarity for texts to be
+                returned as near duplicates.
+            sensitivity (int): Number of unique buckets two ids must co-occur
+                in to be considered a near duplicate pair.
+            include_similarity (bool): yield similarity alongside each pair.
+            batch_size (int): Number of pairs verified at a time.
+
+        Yields:
+            tuple: Pair of labels, followed by their estimated similarity if
+                include_similarity is selected.
+
+        """
+        if sensitivity > self._n_bands:
+            raise ValueError('Sensitivity must be <= no of bands.')
+
+        for first_rows, second_rows in self._candidate_pair_rows(sensitivity):
+            for start in range(0, len(first_rows), batch_size):
+                first_batch = first_rows[start:start + batch_size]
+                second_batch = second_rows[start:start + batch_size]
+
+                if min_jaccard or include_similarity:
+                    jaccard_ratios = self._estimate_similarity(
+                        self._signatures[first_batch],
+                        self._signatures[second_batch]
+                    )
+                else:
+                    jaccard_ratios = np.empty(len(first_batch))
+
+                if min_jaccard:
+                    keep = jaccard_ratios >= min_jaccard
+                    first_batch = first_batch[keep]
+                    second_batch = second_batch[keep]
+                    jaccard_ratios = jaccard_ratios[keep]
+
+                for first_row, second_row, jaccard_ratio in zip(
+                    first_batch.tolist(), second_batch.tolist(), jaccard_ratios.tolist()
+                ):
+                    if include_similarity:
+                        yield (
+                            self._labels[first_row],
+                            self._labels[second_row],
+                            jaccard_ratio
+                        )
+                    else:
+                        yield self._labels[first_row], self._labels[second_row]
+
+    def freeze(self):
+        """ Compacts buckets to a read optimised compressed sparse row form.
+
+        Each band's buckets are held as a sorted int64 array of bucket ids,
+        an offsets array and a flat int32 array of store rows, looked up
+        with np.searchsorted, instead of a dict of Python sets. Later
+        updates and removals are held in a small mutable delta, calling
+        freeze again merges the delta.
+
+        """
+        if isinstance(self._buckets, FrozenDictionaryArray):
+            self._buckets.merge()
+        else:
+            self._buckets = FrozenDictionaryArray.from_dictionary_array(
+                self._buckets
+            )
+
+    def save(self, path):
+        """ Saves the LSH model to a directory in a columnar format.
+
+        The signature matrix, a label table and per band sorted bucket id,
+        offset and row arrays are written as .npy files so the model can be
+        memory mapped by load. Tombstones left by lazy removal are compacted
+        and rows freed by remove are dropped.
+
+        Args:
+            path (str): Directory to save the model to, created if missing.
+
+        """
+        os.makedirs(path, exist_ok=True)
+        self.compact()
+
+        rows = np.array(sorted(self.keys.values()), dtype=np.int64)
+        row_map = np.full(max(self._n_rows, 1), -1, dtype=np.int64)
+        row_map[rows] = np.arange(len(rows))
+
+        if self._signatures is None:
+            signatures = np.empty((0, self.permutations), dtype=np.int64)
+        else:
+            signatures = self._signatures[rows]
+
+        if isinstance(self._buckets, FrozenDictionaryArray):
+            self._buckets.merge()
+            buckets = self._buckets
+        else:
+            buckets = FrozenDictionaryArray.from_dictionary_array(self._buckets)
+
+        bucket_arrays = buckets.arrays()
+        values = row_map[bucket_arrays['values']]
+        bucket_arrays['values'] = values.astype(
+            np.int32 if len(rows) < np.iinfo(np.int32).max else np.int64
+        )
+
+        labels = np.empty(len(rows), dtype=object)
+        labels[:] = [self._labels[row] for row in rows.tolist()]
+
+        np.save(os.path.join(path, 'signatures.npy'), signatures, allow_pickle=True)
+        np.save(os.path.join(path, 'labels.npy'), labels, allow_pickle=True)
+        for name, array in bucket_arrays.items():
+            np.save(os.path.join(path, f'bucket_{name}.npy'), array)
+
+        metadata = {
+            'format_version': _FORMAT_VERSION,
+            'permutations': self.permutations,
+            'no_of_bands': self.no_of_bands,
+            'seed': self.seed,
+            'estimator': self.estimator,
+            'hash_version': self.hash_version,
+            'compact_threshold': self.compact_threshold,
+            'max_bucket_size': self.max_bucket_size,
+            'bucket_overflow': self.bucket_overflow,
+            'rows_per_band': self.rows_per_band,
+            'b_bits': self.b_bits,
+            'signature_dtype': str(signatures.dtype),
+        }
+        with open(os.path.join(path, 'metadata.json'), 'w') as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Loads an LSH model saved with save.
+
+        With mmap the signature matrix and bucket arrays are memory mapped
+        read only, loading is near instant and processes loading the same
+        model share its pages. Updates to a memory mapped model are held in
+        a delta until merged with freeze.
+
+        Args:
+            path (str): Directory the model was saved to.
+            mmap (bool): Memory map arrays rather than reading them into
+                memory, otherwise buckets are loaded as a DictionaryArray.
+
+        Returns:
+            LSH: Loaded LSH model.
+
+        """
+        with open(os.path.join(path, 'metadata.json')) as metadata_file:
+            metadata = json.load(metadata_file)
+
+        if metadata['format_version'] > _FORMAT_VERSION:
+            raise ValueError(
+                f'LSH format version {metadata["format_version"]} is not '
+                'supported, upgrade akin to load this model.'
+            )
+
+        lsh = cls(
+            metadata['permutations'],
+            metadata['no_of_bands'],
+            metadata['seed'],
+            estimator=metadata['estimator'],
+            hash_version=metadata['hash_version'],
+            compact_threshold=metadata.get('compact_threshold', 0.25),
+            max_bucket_size=metadata.get('max_bucket_size'),
+            bucket_overflow=metadata.get('bucket_overflow', 'stop'),
+            rows_per_band=metadata.get('rows_per_band'),
+            b_bits=metadata.get('b_bits')
+        )
+
+        mmap_mode = 'r' if mmap else None
+        signature_mmap_mode = mmap_mode
+        if metadata['signature_dtype'] == 'object':
+            signature_mmap_mode = None
+
+        signatures = np.load(
+            os.path.join(path, 'signatures.npy'),
+            mmap_mode=signature_mmap_mode,
+            allow_pickle=True
+        )
+        labels = np.load(os.path.join(path, 'labels.npy'), allow_pickle=True)
+        buckets = FrozenDictionaryArray(**{
+            name: np.load(
+                os.path.join(path, f'bucket_{name}.npy'), mmap_mode=mmap_mode
+            )
+            for name in ['keys', 'array_offsets', 'key_offsets', 'values']
+        })
+
+        lsh._signatures = signatures
+        lsh._labels = labels.tolist()
+        lsh._n_rows = len(signatures)
+        lsh._dead = np.zeros(len(signatures), dtype=bool)
+        lsh.keys = {label: row for row, label in enumerate(lsh._labels)}
+        lsh._buckets = buckets if mmap else buckets.to_dictionary_array()
+
+        return lsh
+
+    @classmethod
+    def tune_bands(
+        cls,
+        signatures,
+        threshold,
+        estimator='set',
+        seed=1,
+        n_configs=5,
+        false_positive_weight=0.5,
+        false_negative_weight=0.5
+    ):
+        """ Measures candidates and recall of band settings on a sample.
+
+        The band and row combinations with the lowest weighted S-curve
+        error for the threshold are each built on a sample of signatures.
+        Candidate pairs of each model are compared with the sample pairs
+        whose estimated similarity reaches the threshold. Every pair of the
+        sample is verified, so samples of a few thousand signatures suit.
+
+        Args:
+            signatures (np.array): 2D array of sample minhash signatures.
+            threshold (float): Target Jaccard similarity threshold.
+            estimator (str): Jaccard similarity estimator, set or positional.
+            seed (int): Random seed used for hashing.
+            n_configs (int): Number of band and row combinations to measure.
+            false_positive_weight (float): Weight of false positives when
+                ranking combinations.
+            false_negative_weight (float): Weight of false negatives when
+                ranking combinations.
+
+        Returns:
+            list: Dictionary of no_of_bands, rows_per_band, S-curve error,
+                candidates_per_query, recall and precision for each
+                combination, lowest S-curve error first.
+
+        """
+        signatures = np.asarray(signatures)
+        n_signatures, permutations = signatures.shape
+
+        sample = cls(permutations, no_of_bands=1, estimator=estimator, seed=seed)
+        true_pairs = []
+        for row in range(n_signatures - 1):
+            similarities = sample._estimate_similarity(
+                signatures[row], signatures[row + 1:]
+            )
+            matches = np.flatnonzero(similarities >= threshold) + row + 1
+            true_pairs.append(row * n_signatures + matches)
+
+        true_pairs = np.concatenate(true_pairs) if true_pairs else np.empty(0)
+
+        results = []
+        configs = _band_errors(
+            threshold, permutations, false_positive_weight, false_negative_weight
+        )[:n_configs]
+        for error, no_of_bands, rows_per_band in configs:
+            lsh = cls(
+                permutations,
+                no_of_bands,
+                seed,
+                estimator=estimator,
+                rows_per_band=rows_per_band
+            )
+            lsh.update(signatures, range(n_signatures))
+            n_candidates = 0
+            n_found = 0
+            for first_rows, second_rows in lsh._candidate_pair_rows():
+                candidate_pairs = first_rows * n_signatures + second_rows
+                n_candidates += len(candidate_pairs)
+                n_found += int(np.isin(true_pairs, candidate_pairs).sum())
+
+            results.append({
+                'no_of_bands': no_of_bands,
+                'rows_per_band': rows_per_band,
+                'error': error,
+                'candidates_per_query': 2 * n_candidates / n_signatures,
+                'recall': n_found / len(true_pairs) if len(true_pairs) else 1.0,
+                'precision': (
+                    n_found / n_candidates if n_candidates else 1.0
+                ),
+            })
+
+        return results
+
     def get_minhashes(self):
         """ Returns set of minhashes contained in LSH model.
 
@@ -228,14 +2008,19 @@ class LSH:
             set: set of all unique minhashes within LSH model.
 
         """
-        values = self._buckets.values()
+        values = {
+            self._labels[row] for row in self._buckets.values()
+            if not self._dead[row]
+        }
         return values
 
     def adjacency_list(
         self,
         labels=None,
         min_jaccard=None,
-        sensitivity=1
+        sensitivity=1,
+        n_jobs=1,
+        shard_size=None
     ):
         """ Returns adjacency list.
 
@@ -245,12 +2030,15 @@ class LSH:
         Can be used to create an undirected graph for texts in the LSH object.
 
         Args:
-            minhash_signatures (list): list of minhash signatures to use as
-                keys.
+            labels (list): Labels to limit the adjacency list to.
             min_jaccard (float): Minimum Jaccard Similarity for texts to be
                 returned as near duplicates.
             sensitivity (int): Number of unique buckets two ids must co-occur
                 in to be considered a near duplicate pair.
+            n_jobs (int): Number of workers, 1 queries labels in the current
+                process and -1 uses all CPUs.
+            shard_size (int): Number of labels queried by a worker at a time,
+                defaults to four shards per worker.
 
         Returns:
             dict: Adjacency list.
@@ -259,18 +2047,114 @@ class LSH:
         if labels is None:
             labels = self.keys.keys()
 
-        if sensitivity > self.no_of_bands:
+        if sensitivity > self._n_bands:
             raise ValueError(
                 'Sensitivity must be <= no of bands.'
             )
 
-        adjacency_list = {}
+        rows = np.array([self.keys[label] for label in labels], dtype=np.int64)
 
-        for label in tqdm(labels):
-            adjacency_list[label] = self.query(
-                label,
-                min_jaccard,
-                sensitivity
+        if n_jobs != 1:
+            return self._parallel_adjacency_list(
+                rows, min_jaccard, sensitivity, n_jobs, shard_size
+            )
+
+        near_duplicates = []
+        with tqdm(total=len(rows)) as progress:
+            for start in range(0, len(rows), _QUERY_BATCH_SIZE):
+                batch_rows = rows[start:start + _QUERY_BATCH_SIZE]
+                query_ids, candidate_rows, _ = self._query_batch_rows(
+                    self._signatures[batch_rows],
+                    batch_rows,
+                    min_jaccard,
+                    sensitivity
+                )
+                near_duplicates.extend(
+                    self._to_labels(len(batch_rows), query_ids, candidate_rows)
+                )
+                progress.update(len(batch_rows))
+
+        return dict(zip(self._to_labels_list(rows), near_duplicates))
+
+    def _to_labels_list(self, rows):
+        """ Translates store rows to their labels.
+
+        Args:
+            rows (np.array): Store rows.
+
+        Returns:
+            list: Label of each row.
+
+        """
+        return [self._labels[row] for row in rows.tolist()]
+
+    def _parallel_adjacency_list(
+        self,
+        rows,
+        min_jaccard,
+        sensitivity,
+        n_jobs=-1,
+        shard_size=None
+    ):
+        """ Returns adjacency list computed by parallel workers.
+
+        Store rows are split into shards and queried by worker processes
+        forked from the current process, so the buckets and signature store
+        are shared copy-on-write rather than pickled to each worker. Workers
+        exchange integer row arrays only, labels are restored here. Threads
+        are used where fork is not available.
+
+        Args:
+            rows (np.array): Store rows to include in the adjacency list.
+            min_jaccard (float): Minimum Jaccard Similarity for texts to be
+                returned as near duplicates.
+            sensitivity (int): Number of unique buckets two ids must co-occur
+                in to be considered a near duplicate pair.
+            n_jobs (int): Number of workers, -1 uses all CPUs.
+            shard_size (int): Number of labels queried by a worker at a time.
+
+        Returns:
+            dict: Adjacency list, identical to the serial adjacency list.
+
+        """
+        global _SHARED_LSH
+
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+
+        if shard_size is None:
+            shard_size = max(1, -(-len(rows) // (n_jobs * 4)))
+
+        shards = [
+            rows[start:start + shard_size]
+            for start in range(0, len(rows), shard_size)
+        ]
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            executor = ProcessPoolExecutor(
+                max_workers=n_jobs,
+                mp_context=multiprocessing.get_context('fork')
             )
+        else:
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+
+        _SHARED_LSH = self
+        try:
+            with executor:
+                results = executor.map(
+                    _adjacency_shard,
+                    shards,
+                    itertools.repeat(min_jaccard),
+                    itertools.repeat(sensitivity)
+                )
+                near_duplicates = []
+                for shard, (query_ids, candidate_rows) in zip(
+                    shards, tqdm(results, total=len(shards))
+                ):
+                    near_duplicates.extend(
+                        self._to_labels(len(shard), query_ids, candidate_rows)
+                    )
+        finally:
+            _SHARED_LSH = None
 
-        return adjacency_list
+        return dict(zip(self._to_labels_list(rows), near_duplicates))
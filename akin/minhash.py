@@ -1,7 +1,144 @@
-import heapq
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import mmh3
 
+# Mersenne prime modulus for universal hashing, 2^61 = 1 mod p lets
+# (a * h + b) mod p be computed exactly in uint64 for any a, b < p.
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_LOW_32_BITS = np.uint64((1 << 32) - 1)
+_LOW_29_BITS = np.uint64((1 << 29) - 1)
+_UNIVERSAL_CHUNK_SIZE = 4096
+_WINDOW_CHUNK_SIZE = 4096
+_SPACE = ord(' ')
+
+
+def _mersenne_reduce(values):
+    """ Reduces uint64 values modulo the Mersenne prime 2^61 - 1.
+
+    Args:
+        values (np.array): uint64 values.
+
+    Returns:
+        np.array: Values reduced to [0, p).
+
+    """
+    values = (values & _MERSENNE_PRIME) + (values >> np.uint64(61))
+    return np.where(values >= _MERSENNE_PRIME, values - _MERSENNE_PRIME, values)
+
+
+def _universal_permute(hashes, coefficients_a, coefficients_b):
+    """ Computes (a * h + b) mod p exactly without overflowing uint64.
+
+    The product of a 61 bit a and a 32 bit h is split into the low and high
+    32 bits of a, the high partial product is shifted by 2^32 modulo p
+    using 2^61 = 1 mod p.
+
+    Args:
+        hashes (np.array): Column of 32 bit shingle hashes.
+        coefficients_a (np.array): Multipliers in [1, p), one per permutation.
+        coefficients_b (np.array): Offsets in [0, p), one per permutation.
+
+    Returns:
+        np.array: Permuted hash of each shingle for each permutation.
+
+    """
+    low = coefficients_a & _LOW_32_BITS
+    high = coefficients_a >> np.uint64(32)
+
+    low_product = hashes * low
+    low_product = (
+        (low_product & _MERSENNE_PRIME) + (low_product >> np.uint64(61))
+    )
+
+    high_product = hashes * high
+    high_product = (
+        (high_product >> np.uint64(29))
+        + ((high_product & _LOW_29_BITS) << np.uint64(32))
+    )
+
+    return _mersenne_reduce(
+        _mersenne_reduce(low_product + high_product) + coefficients_b
+    )
+
+
+def _transform_chunk(minhash, chunk):
+    """ Transforms a chunk of texts in a worker process.
+
+    Args:
+        minhash (MinHash): MinHash object used to generate signatures.
+        chunk (list): Texts to transform.
+
+    Returns:
+        list: Signatures for the chunk of texts.
+
+    """
+    return minhash.transform(chunk)
+
+
+class _ShingleWindows:
+    """ Lazy sequence of n-gram windows over an encoded text buffer.
+
+    Iterating yields memoryview slices of the buffer, so no substring is
+    copied and only a chunk of window offsets is converted at a time.
+
+    """
+    def __init__(self, buffer, starts, ends):
+        """ Wraps window offsets into an encoded text buffer.
+
+        Args:
+            buffer (bytes): UTF-8 encoded text.
+            starts (range or np.array): Byte offset each window starts at.
+            ends (range or np.array): Byte offset each window ends at.
+
+        """
+        self._buffer = buffer
+        self._starts = starts
+        self._ends = ends
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        view = memoryview(self._buffer)
+        if isinstance(self._starts, range):
+            for start, end in zip(self._starts, self._ends):
+                yield view[start:end]
+
+            return
+
+        for chunk in range(0, len(self._starts), _WINDOW_CHUNK_SIZE):
+            starts = self._starts[chunk:chunk + _WINDOW_CHUNK_SIZE].tolist()
+            ends = self._ends[chunk:chunk + _WINDOW_CHUNK_SIZE].tolist()
+            for start, end in zip(starts, ends):
+                yield view[start:end]
+
+    def unique(self):
+        """ Removes repeated windows, keeping the first of each.
+
+        Windows are deduplicated by a 64 bit hash of their bytes held in an
+        integer array, rather than as memoryviews in a dictionary.
+
+        Returns:
+            _ShingleWindows: Windows with distinct contents.
+
+        """
+        keys = np.fromiter(
+            (mmh3.mmh3_x64_128_stupledigest(window, 0)[0] for window in self),
+            dtype=np.int64,
+            count=len(self)
+        )
+        _, first = np.unique(keys, return_index=True)
+        first = np.sort(first)
+
+        return _ShingleWindows(
+            self._buffer,
+            np.asarray(self._starts)[first],
+            np.asarray(self._ends)[first]
+        )
+
 
 class MinHash:
     """ MinHash base class.
@@ -13,6 +150,7 @@ class MinHash:
             signatures.
         hash_bits (int): Hash value size used to generate signatures.
         seed (int): Seed used to generate signatures.
+        shingling (str): Shingle generation mode, text or buffer.
 
     """
     def __init__(
@@ -21,7 +159,8 @@ class MinHash:
         n_gram_type='char',
         permutations=100,
         hash_bits=64,
-        seed=None
+        seed=None,
+        shingling='text'
     ):
         """ Generates a minhash signature matrix for texts in a corpus.
 
@@ -33,10 +172,22 @@ class MinHash:
                 signature.
             hash_bits (int): Hash value size, must be 32, 64 or 128 bit.
             seed (int): Seeds from which to generate random hash function.
+            shingling (str): Shingle generation mode, must be text to build a
+                list of substring shingles or buffer to hash n-grams directly
+                from the UTF-8 encoded text without creating substrings,
+                generating identical signatures with far less allocation
+                for long texts.
 
         """
         self.n_gram = n_gram
 
+        if shingling not in ['text', 'buffer']:
+            raise ValueError(
+                'Only "text" and "buffer" shingling modes are supported.'
+            )
+
+        self.shingling = shingling
+
         if n_gram_type not in ['char', 'term']:
             raise ValueError(
                 'Only "char" and "term" n_gram types are supported.'
@@ -75,7 +226,9 @@ class MinHash:
             texts = [texts]
 
         for text in texts:
-            if self.n_gram_type == 'char':
+            if self.shingling == 'buffer':
+                shingles = self._shingle_windows(text)
+            elif self.n_gram_type == 'char':
                 shingles = [
                     text[char:char + self.n_gram] for char in range(len(text))
                 ][:trim_overflow]
@@ -96,17 +249,71 @@ class MinHash:
 
             yield shingles
 
+    def _shingle_windows(self, text):
+        """ Locates n-gram windows of a text within its encoded buffer.
+
+        Character windows span n_gram characters, term windows span n_gram
+        whitespace separated terms of the text with runs of whitespace
+        collapsed to a single space, matching the text shingles byte for
+        byte.
+
+        Args:
+            text (str): Input text.
+
+        Returns:
+            _ShingleWindows: Lazy sequence of shingle windows.
+
+        """
+        if self.n_gram_type == 'char':
+            buffer = text.encode('utf-8')
+            n_windows = max(len(text) - self.n_gram + 1, 0)
+
+            if len(buffer) == len(text):
+                return _ShingleWindows(
+                    buffer,
+                    range(n_windows),
+                    range(self.n_gram, self.n_gram + n_windows)
+                )
+
+            # Multi-byte characters start with any byte but a continuation.
+            bytes_array = np.frombuffer(buffer, dtype=np.uint8)
+            offsets = np.append(
+                np.flatnonzero((bytes_array & 0xC0) != 0x80), len(buffer)
+            )
+
+            return _ShingleWindows(
+                buffer,
+                offsets[:n_windows],
+                offsets[self.n_gram:self.n_gram + n_windows]
+            )
+
+        buffer = ' '.join(text.split()).encode('utf-8')
+        spaces = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == _SPACE)
+        term_starts = np.append(0, spaces + 1) if buffer else spaces
+        term_ends = np.append(spaces, len(buffer)) if buffer else spaces
+        n_windows = max(len(term_starts) - self.n_gram + 1, 0)
+
+        return _ShingleWindows(
+            buffer,
+            term_starts[:n_windows],
+            term_ends[self.n_gram - 1:self.n_gram - 1 + n_windows]
+        )
+
     def _hashing(self, shingle, seed):
         """ Performs hashing using seed generated hash.
 
         Args:
-            shingle(str): Text shingle to hash.
+            shingle(str): Text shingle, or memoryview of an encoded shingle,
+                to hash.
             seed(int): Seed for generating hash function.
 
         Returns:
             int: Hashed shingle.
 
         """
+        if not isinstance(shingle, str):
+            return self._hash_buffer(shingle, seed)
+
         if self.hash_bits == 64:
             hashed_shingle = mmh3.hash64(shingle, seed)[0]
         elif self.hash_bits == 32:
@@ -116,6 +323,113 @@ class MinHash:
 
         return hashed_shingle
 
+    def _hash_buffer(self, shingle, seed):
+        """ Hashes an encoded shingle, identical to hashing its text.
+
+        Args:
+            shingle(memoryview): UTF-8 encoded text shingle to hash.
+            seed(int): Seed for generating hash function.
+
+        Returns:
+            int: Hashed shingle.
+
+        """
+        if self.hash_bits == 64:
+            hashed_shingle = mmh3.mmh3_x64_128_stupledigest(shingle, seed)[0]
+        elif self.hash_bits == 32:
+            hashed_shingle = mmh3.mmh3_32_sintdigest(shingle, seed)
+        else:
+            hashed_shingle = mmh3.mmh3_x64_128_uintdigest(shingle, seed)
+
+        return hashed_shingle
+
+    def _parallel_transform(
+        self,
+        text_corpus,
+        n_jobs=-1,
+        chunk_size=None,
+        executor=None
+    ):
+        """ Transforms texts to minhash signatures across worker processes.
+
+        The corpus is split into chunks, each chunk is transformed in a
+        worker process and the signatures returned in input order. The
+        MinHash object is pickled once per chunk rather than once per text.
+
+        Args:
+            text_corpus(list): 2D Iterable containing text content of each
+                document.
+            n_jobs (int): Number of worker processes, -1 uses all CPUs.
+            chunk_size (int): Number of texts sent to a worker at a time,
+                defaults to splitting the corpus into four chunks per worker.
+            executor (concurrent.futures.Executor): Optional existing executor
+                to submit chunks to, n_jobs is ignored if provided.
+
+        Returns:
+            list: List of minhash signatures, or a 2D np.array of signatures
+                if the signature method returns arrays.
+
+        """
+        if isinstance(text_corpus, str):
+            text_corpus = [text_corpus]
+
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+
+        if chunk_size is None:
+            if hasattr(text_corpus, '__len__'):
+                chunk_size = max(1, -(-len(text_corpus) // (n_jobs * 4)))
+            else:
+                chunk_size = 1000
+
+        texts = iter(text_corpus)
+        chunks = iter(lambda: list(itertools.islice(texts, chunk_size)), [])
+
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                results = list(
+                    pool.map(_transform_chunk, itertools.repeat(self), chunks)
+                )
+        else:
+            results = list(
+                executor.map(_transform_chunk, itertools.repeat(self), chunks)
+            )
+
+        if results and isinstance(results[0], np.ndarray):
+            return np.vstack(results)
+
+        return [signature for result in results for signature in result]
+
+    def transform_iter(self, text_corpus, batch_size=1000):
+        """ Lazily transforms texts to minhash signatures in fixed size batches.
+
+        Consumes any iterable of texts without materializing the corpus, only
+        a single batch of texts and signatures is held in memory at a time.
+        Batches can be passed directly to LSH.update along with an iterator
+        of labels, which zip consumes one batch at a time.
+
+        Args:
+            text_corpus(iterable): Iterable of texts, may be a generator.
+            batch_size (int): Number of texts in each batch.
+
+        Yields:
+            np.array: 2D array of signatures for each batch of texts.
+
+        """
+        if batch_size < 1:
+            raise ValueError('Batch size must be an integer of 1 or greater')
+
+        if isinstance(text_corpus, str):
+            text_corpus = [text_corpus]
+
+        texts = iter(text_corpus)
+        while True:
+            batch = list(itertools.islice(texts, batch_size))
+            if not batch:
+                return
+
+            yield np.asarray(self.transform(batch))
+
 
 class KMinHash(MinHash):
     """ Generates minhash signatures by concatenating the min value of j
@@ -124,17 +438,50 @@ class KMinHash(MinHash):
     Attributes:
         hash_seeds (np.array): randomly generated seeds for each of j
             permutation hashes.
+        method (str): Signature generation method, multi_hash or universal.
+        estimator (str): LSH similarity estimator matching the signatures.
 
     """
-    def __init__(self, *args, **kwargs):
+    estimator = 'positional'
+
+    def __init__(self, *args, method='multi_hash', **kwargs):
+        """ Generates minhash signatures using j permutation hashes.
+
+        Args:
+            method (str): Signature generation method, must be multi_hash to
+                hash each shingle once per permutation or universal to hash
+                each shingle once and derive permutations using universal
+                hashing.
+
+        """
         super().__init__(*args, **kwargs)
 
+        if method not in ['multi_hash', 'universal']:
+            raise ValueError(
+                'Only "multi_hash" and "universal" methods are supported.'
+            )
+
+        self.method = method
         self.hash_seeds = np.random.randint(
             low=1,
             high=100000000,
             size=self.permutations
         )
 
+        if method == 'universal':
+            self._coefficients_a = np.random.randint(
+                low=1,
+                high=int(_MERSENNE_PRIME),
+                size=self.permutations,
+                dtype=np.uint64
+            )
+            self._coefficients_b = np.random.randint(
+                low=0,
+                high=int(_MERSENNE_PRIME),
+                size=self.permutations,
+                dtype=np.uint64
+            )
+
     def _multi_hash(self, shingles):
         """ Generates a texts minhash signature using multi-hash method.
 
@@ -149,11 +496,17 @@ class KMinHash(MinHash):
         """
         signatures = []
         for document in shingles:
+            # Repeated shingles cannot change a minimum, hash each once.
+            if isinstance(document, _ShingleWindows):
+                unique_shingles = document.unique()
+            else:
+                unique_shingles = dict.fromkeys(document)
+
             signature = []
             for seed in np.nditer(self.hash_seeds):
                 min_value = None
 
-                for shingle in document:
+                for shingle in unique_shingles:
                     hash_value = self._hashing(shingle, int(seed))
 
                     if not min_value:
@@ -167,19 +520,92 @@ class KMinHash(MinHash):
 
         return signatures
 
-    def transform(self, text_corpus):
+    @staticmethod
+    def _hash_unsigned_32(shingle, seed):
+        """ Hashes a shingle to an unsigned 32 bit value.
+
+        Args:
+            shingle(str): Text shingle, or memoryview of an encoded shingle,
+                to hash.
+            seed(int): Seed for generating hash function.
+
+        Returns:
+            int: Hashed shingle.
+
+        """
+        if isinstance(shingle, str):
+            return mmh3.hash(shingle, seed, signed=False)
+
+        return mmh3.mmh3_32_uintdigest(shingle, seed)
+
+    def _universal_hash(self, shingles):
+        """ Generates text minhash signatures using universal hashing.
+
+        Each shingle is hashed once to an unsigned 32 bit value h, the j
+        permutations are then derived as (a * h + b) mod p over a uint64
+        matrix and the minimum taken for each permutation.
+
+        Returns:
+            np.array: 2D array of uint64 signatures, one row per text.
+
+        """
+        seed = int(self.hash_seeds[0])
+        signatures = []
+        for document in shingles:
+            # Repeated shingles cannot change a minimum, each hash is
+            # permuted once.
+            hashes = np.unique(np.fromiter(
+                (self._hash_unsigned_32(shingle, seed) for shingle in document),
+                dtype=np.uint64,
+                count=len(document)
+            ))
+
+            # Shingles are permuted in chunks to bound the size of the matrix.
+            signature = np.full(
+                self.permutations, _MERSENNE_PRIME, dtype=np.uint64
+            )
+            for start in range(0, len(hashes), _UNIVERSAL_CHUNK_SIZE):
+                permuted = _universal_permute(
+                    hashes[start:start + _UNIVERSAL_CHUNK_SIZE, None],
+                    self._coefficients_a,
+                    self._coefficients_b
+                )
+                np.minimum(signature, permuted.min(axis=0), out=signature)
+
+            signatures.append(signature)
+
+        if not signatures:
+            return np.empty((0, self.permutations), dtype=np.uint64)
+
+        return np.vstack(signatures)
+
+    def transform(self, text_corpus, n_jobs=1, chunk_size=None, executor=None):
         """ Transform text to Minhash arrays using multi-hash method.
 
         Args:
             text_corpus(list): 2D Iterable containing text content of each
                 document.
+            n_jobs (int): Number of worker processes, 1 transforms texts in
+                the current process and -1 uses all CPUs.
+            chunk_size (int): Number of texts sent to each worker at a time.
+            executor (concurrent.futures.Executor): Optional existing executor
+                to transform chunks with.
 
         Returns:
-            list: List of minhash tuple signatures.
+            list: List of minhash tuple signatures, or a 2D np.array of
+                signatures if the universal method is used.
 
         """
+        if n_jobs != 1 or executor is not None:
+            return self._parallel_transform(
+                text_corpus, n_jobs, chunk_size, executor
+            )
+
         shingles = self._k_shingles(text_corpus)
 
+        if self.method == 'universal':
+            return self._universal_hash(shingles)
+
         return self._multi_hash(shingles)
 
 
@@ -187,7 +613,12 @@ class UniMinHash(MinHash):
     """ Generates minhash signatures using k-smallest values of a single
     permutation hash.
 
+    Attributes:
+        estimator (str): LSH similarity estimator matching the signatures.
+
     """
+    estimator = 'set'
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -205,12 +636,11 @@ class UniMinHash(MinHash):
                 neighbours method.
 
         """
+        # 128 bit hashes exceed int64 and are partitioned as Python ints.
+        dtype = object if self.hash_bits == 128 else np.int64
+
         signatures = []
         for document in shingles:
-            signature = []
-            # Uses a heap queue to make finding smallest values more efficient.
-            heapq.heapify(signature)
-
             if len(document) <= self.permutations:
                 raise ValueError(
                     'N permutations must not be >= n shingles for '
@@ -219,26 +649,174 @@ class UniMinHash(MinHash):
                     f'{self.permutations} permutations.'
                 )
 
-            for shingle in document:
-                hashed_shingle = self._hashing(shingle, self.seed)
-                heapq.heappush(signature, hashed_shingle)
+            hashed_shingles = np.fromiter(
+                (self._hashing(shingle, self.seed) for shingle in document),
+                dtype=dtype,
+                count=len(document)
+            )
 
-            k_smallest_hashes = heapq.nsmallest(self.permutations, signature)
-            signatures.append(tuple(k_smallest_hashes))
+            # Partition selects the k smallest hashes, only those are sorted.
+            k_smallest_hashes = np.partition(
+                hashed_shingles, self.permutations - 1
+            )[:self.permutations]
+            k_smallest_hashes.sort()
+            signatures.append(tuple(k_smallest_hashes.tolist()))
 
         return signatures
 
-    def transform(self, text_corpus):
+    def transform(self, text_corpus, n_jobs=1, chunk_size=None, executor=None):
         """ Transform text to Minhash arrays using k-smallest hash method.
 
         Args:
             text_corpus(list): 2D Iterable containing text content of each
                 document.
+            n_jobs (int): Number of worker processes, 1 transforms texts in
+                the current process and -1 uses all CPUs.
+            chunk_size (int): Number of texts sent to each worker at a time.
+            executor (concurrent.futures.Executor): Optional existing executor
+                to transform chunks with.
 
         Returns:
             list: List of minhash tuple signatures.
 
         """
+        if n_jobs != 1 or executor is not None:
+            return self._parallel_transform(
+                text_corpus, n_jobs, chunk_size, executor
+            )
+
         shingles = self._k_shingles(text_corpus)
 
         return self._k_smallest_hash(shingles)
+
+
+class OPHMinHash(MinHash):
+    """ Generates minhash signatures using one permutation hashing.
+
+    Each shingle is hashed once and the hash range split into j bins, the
+    minimum hash falling in each bin forms the signature. Bins left empty
+    by shorter texts are filled by optimal densification, each borrowing
+    the value of a non-empty bin chosen by a fixed random probe sequence,
+    so the signatures of all texts stay positionally comparable.
+
+    Attributes:
+        hash_seed (int): Seed of the single shingle hash.
+        estimator (str): LSH similarity estimator matching the signatures.
+
+    """
+    estimator = 'positional'
+
+    def __init__(self, *args, **kwargs):
+        """ Generates minhash signatures using one permutation hashing.
+
+        Texts may have fewer shingles than permutations, hash_bits must be
+        32 or 64.
+
+        """
+        super().__init__(*args, **kwargs)
+
+        if self.hash_bits == 128:
+            raise ValueError(
+                'Only 32 and 64 bit hashes are supported for one permutation '
+                'hashing.'
+            )
+
+        self.hash_seed = int(np.random.randint(low=1, high=100000000))
+
+        # A single bin spans the whole range, which does not fit in uint64.
+        bin_width = -(-(1 << self.hash_bits) // self.permutations)
+        self._bin_width = np.uint64(min(bin_width, (1 << 64) - 1))
+        self._probes = []
+
+    def _probe_round(self, round_id):
+        """ Returns the bin each bin probes in a densification round.
+
+        Args:
+            round_id (int): Densification round.
+
+        Returns:
+            np.array: Probed bin for each bin.
+
+        """
+        while len(self._probes) <= round_id:
+            rng = np.random.default_rng([self.hash_seed, len(self._probes)])
+            self._probes.append(
+                rng.integers(0, self.permutations, size=self.permutations)
+            )
+
+        return self._probes[round_id]
+
+    def _one_permutation_hash(self, shingles):
+        """ Generates text minhash signatures using one permutation hashing.
+
+        Returns:
+            np.array: 2D array of uint64 signatures, one row per text.
+
+        """
+        signatures = []
+        for document in shingles:
+            # Every occurrence is hashed, duplicates are left for np.minimum.at
+            # as a repeated hash cannot lower the minimum of its bin.
+            hashes = np.fromiter(
+                (self._hashing(shingle, self.hash_seed) for shingle in document),
+                dtype=np.int64,
+                count=len(document)
+            ).view(np.uint64)
+
+            if self.hash_bits == 32:
+                hashes &= np.uint64(0xFFFFFFFF)
+
+            bins = np.minimum(
+                hashes // self._bin_width, self.permutations - 1
+            ).astype(np.intp)
+
+            signature = np.full(
+                self.permutations, np.iinfo(np.uint64).max, dtype=np.uint64
+            )
+            np.minimum.at(signature, bins, hashes)
+
+            empty = np.ones(self.permutations, dtype=bool)
+            empty[bins] = False
+
+            # Empty bins probe until they find a bin that was filled by a
+            # shingle, never one filled by densification.
+            pending = np.flatnonzero(empty)
+            round_id = 0
+            while len(pending):
+                probed = self._probe_round(round_id)[pending]
+                found = ~empty[probed]
+                signature[pending[found]] = signature[probed[found]]
+                pending = pending[~found]
+                round_id += 1
+
+            signatures.append(signature)
+
+        if not signatures:
+            return np.empty((0, self.permutations), dtype=np.uint64)
+
+        return np.vstack(signatures)
+
+    def transform(self, text_corpus, n_jobs=1, chunk_size=None, executor=None):
+        """ Transform text to Minhash arrays using one permutation hashing.
+
+        Args:
+            text_corpus(list): 2D Iterable containing text content of each
+                document.
+            n_jobs (int): Number of worker processes, 1 transforms texts in
+                the current process and -1 uses all CPUs.
+            chunk_size (int): Number of texts sent to each worker at a time.
+            executor (concurrent.futures.Executor): Optional existing executor
+                to transform chunks with.
+
+        Returns:
+            np.array: 2D array of uint64 signatures, one row per text.
+
+        """
+        if n_jobs != 1 or executor is not None:
+            return self._parallel_transform(
+                text_corpus, n_jobs, chunk_size, executor
+            )
+
+        shingles = self._k_shingles(text_corpus)
+
+        return self._one_permutation_hash(shingles)
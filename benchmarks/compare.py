@@ -0,0 +1,87 @@
+""" Compares two benchmark suite result files.
+
+Prints the change in every shared metric and exits with status 1 if any
+throughput metric falls, or any time or memory metric rises, by more
+than the tolerance.
+
+Usage:
+    python benchmarks/compare.py baseline.json candidate.json --tolerance 0.1
+
+"""
+import argparse
+import json
+import sys
+
+# Metrics where a larger value is a regression, all others are throughput.
+_LOWER_IS_BETTER = {'seconds', 'peak_rss_mb', 'candidates_per_query'}
+# Metrics describing results rather than performance, reported only.
+_INFORMATIONAL = {'recall', 'pairs', 'near_duplicates_per_doc'}
+
+
+def compare(baseline, candidate, tolerance=0.1):
+    """ Compares the metrics of two benchmark reports.
+
+    Args:
+        baseline (dict): Baseline benchmark report.
+        candidate (dict): Candidate benchmark report.
+        tolerance (float): Relative change allowed before a metric counts as
+            a regression.
+
+    Returns:
+        list: Case, metric, baseline value, candidate value, relative change
+            and whether it is a regression for each shared metric.
+
+    """
+    rows = []
+    for case, baseline_metrics in baseline['results'].items():
+        candidate_metrics = candidate['results'].get(case, {})
+        for metric, baseline_value in baseline_metrics.items():
+            candidate_value = candidate_metrics.get(metric)
+            if not baseline_value or candidate_value is None:
+                continue
+
+            change = (candidate_value - baseline_value) / baseline_value
+            if metric in _INFORMATIONAL:
+                regression = False
+            elif metric in _LOWER_IS_BETTER:
+                regression = change > tolerance
+            else:
+                regression = change < -tolerance
+
+            rows.append(
+                (case, metric, baseline_value, candidate_value, change, regression)
+            )
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    with open(args.candidate) as candidate_file:
+        candidate = json.load(candidate_file)
+
+    if baseline['metadata']['config'] != candidate['metadata']['config']:
+        print('Warning: benchmark configurations differ.')
+
+    rows = compare(baseline, candidate, args.tolerance)
+    for case, metric, baseline_value, candidate_value, change, regression in rows:
+        flag = '  REGRESSION' if regression else ''
+        print(
+            f'{case:<26}{metric:<26}{baseline_value:>12.4g}'
+            f'{candidate_value:>12.4g}{change:>+9.1%}{flag}'
+        )
+
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
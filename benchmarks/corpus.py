@@ -0,0 +1,99 @@
+""" Synthetic corpus generator for benchmarks.
+
+Generates texts of random terms where a controlled fraction are near
+duplicates, mutated copies of an earlier text, so corpus size, text
+length and near-duplicate rate can be varied independently.
+
+"""
+import random
+import string
+
+
+def _vocabulary(size, rng):
+    """ Generates a vocabulary of random lower case terms.
+
+    Args:
+        size (int): Number of terms.
+        rng (random.Random): Random number generator.
+
+    Returns:
+        list: Random terms of 2 to 10 letters.
+
+    """
+    return [
+        ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+        for _ in range(size)
+    ]
+
+
+def _mutate(terms, mutation_rate, vocabulary, rng):
+    """ Replaces, deletes or inserts a fraction of terms.
+
+    Args:
+        terms (list): Terms of the source text.
+        mutation_rate (float): Fraction of terms to mutate.
+        vocabulary (list): Terms to insert or replace with.
+        rng (random.Random): Random number generator.
+
+    Returns:
+        list: Mutated terms.
+
+    """
+    mutated = list(terms)
+    for _ in range(max(1, int(len(terms) * mutation_rate))):
+        position = rng.randrange(len(mutated))
+        operation = rng.random()
+        if operation < 0.6:
+            mutated[position] = rng.choice(vocabulary)
+        elif operation < 0.8 and len(mutated) > 1:
+            del mutated[position]
+        else:
+            mutated.insert(position, rng.choice(vocabulary))
+
+    return mutated
+
+
+def generate_corpus(
+    n_texts=10000,
+    text_length=200,
+    near_duplicate_rate=0.2,
+    mutation_rate=0.1,
+    vocabulary_size=20000,
+    seed=1
+):
+    """ Generates a corpus with a controlled near-duplicate rate.
+
+    Args:
+        n_texts (int): Number of texts in the corpus.
+        text_length (int): Number of terms in each original text.
+        near_duplicate_rate (float): Fraction of texts that are mutated
+            copies of an earlier text.
+        mutation_rate (float): Fraction of terms changed in each near
+            duplicate.
+        vocabulary_size (int): Number of distinct terms.
+        seed (int): Random seed, the same seed generates the same corpus.
+
+    Returns:
+        tuple: List of texts and list of the source text index of each
+            near duplicate, -1 for original texts.
+
+    """
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(vocabulary_size, rng)
+
+    texts = []
+    sources = []
+    terms = []
+    for index in range(n_texts):
+        if index and rng.random() < near_duplicate_rate:
+            source = rng.randrange(index)
+            text_terms = _mutate(terms[source], mutation_rate, vocabulary, rng)
+        else:
+            source = -1
+            text_terms = rng.choices(vocabulary, k=text_length)
+
+        terms.append(text_terms)
+        texts.append(' '.join(text_terms))
+        sources.append(source)
+
+    return texts, sources
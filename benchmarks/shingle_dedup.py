@@ -0,0 +1,143 @@
+""" Benchmarks shingle deduplication on repetitive and varied corpora.
+
+Compares transform against a reference that hashes every shingle
+occurrence, as minhashing did before deduplication, and checks both
+produce identical signatures.
+
+Usage:
+    python benchmarks/shingle_dedup.py --texts 50 --repeats 40
+
+"""
+import argparse
+import random
+import string
+import time
+
+import numpy as np
+
+from akin import KMinHash, UniMinHash
+
+_FOOTER = (
+    'This message and any attachments are confidential and intended solely '
+    'for the addressee, if you have received it in error notify the sender. '
+)
+_VOCABULARY = [
+    'jupiter', 'hydrogen', 'helium', 'mass', 'planet', 'orbit', 'storm',
+    'moon', 'atmosphere', 'composition', 'spot', 'shrink', 'model'
+]
+
+
+def _random_vocabulary(size, rng):
+    """ Generates a vocabulary of random lower case terms.
+
+    Args:
+        size (int): Number of terms.
+        rng (random.Random): Random number generator.
+
+    Returns:
+        list: Random terms of 2 to 10 letters.
+
+    """
+    return [
+        ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+        for _ in range(size)
+    ]
+
+
+def _corpus(n_texts, repeats, n_terms, vocabulary, rng):
+    """ Generates texts of random terms followed by a repeated footer.
+
+    Args:
+        n_texts (int): Number of texts to generate.
+        repeats (int): Times the boilerplate footer is repeated per text.
+        n_terms (int): Number of random terms per text.
+        vocabulary (list): Terms to draw from.
+        rng (random.Random): Random number generator.
+
+    Returns:
+        list: Generated texts.
+
+    """
+    return [
+        ' '.join(rng.choice(vocabulary) for _ in range(n_terms))
+        + ' ' + _FOOTER * repeats
+        for _ in range(n_texts)
+    ]
+
+
+def _reference_signatures(minhash, texts):
+    """ Generates signatures hashing every shingle occurrence.
+
+    Args:
+        minhash (MinHash): Configured minhash object.
+        texts (list): Texts to generate signatures for.
+
+    Returns:
+        list: List of minhash tuple signatures.
+
+    """
+    signatures = []
+    for document in minhash._k_shingles(texts):
+        if isinstance(minhash, UniMinHash):
+            hashes = [minhash._hashing(shingle, minhash.seed) for shingle in document]
+            signatures.append(tuple(sorted(hashes)[:minhash.permutations]))
+            continue
+
+        signatures.append(tuple(
+            min(minhash._hashing(shingle, int(seed)) for shingle in document)
+            for seed in minhash.hash_seeds
+        ))
+
+    return signatures
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--texts', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=40)
+    parser.add_argument('--terms', type=int, default=100)
+    parser.add_argument('--permutations', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # The varied corpus draws from a large random vocabulary so its texts
+    # repeat almost no shingles, a control for the repetitive corpus.
+    corpora = {
+        'repetitive': _corpus(args.texts, args.repeats, args.terms, _VOCABULARY, rng),
+        'varied': _corpus(
+            args.texts,
+            0,
+            args.terms + args.repeats * 25,
+            _random_vocabulary(50000, rng),
+            rng
+        )
+    }
+    minhashes = {
+        'KMinHash': KMinHash(permutations=args.permutations, seed=args.seed),
+        'UniMinHash': UniMinHash(permutations=args.permutations, seed=args.seed)
+    }
+
+    print(f'{"corpus":<12}{"minhash":<12}{"reference s":>13}{"dedup s":>10}{"speedup":>10}')
+    for corpus_name, texts in corpora.items():
+        for minhash_name, minhash in minhashes.items():
+            expected, reference_time = _timed(_reference_signatures, minhash, texts)
+            signatures, dedup_time = _timed(minhash.transform, texts)
+
+            if not np.array_equal(np.asarray(signatures), np.asarray(expected)):
+                raise AssertionError(f'{minhash_name} signatures changed.')
+
+            print(
+                f'{corpus_name:<12}{minhash_name:<12}{reference_time:>13.3f}'
+                f'{dedup_time:>10.3f}{reference_time / dedup_time:>9.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
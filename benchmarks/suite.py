@@ -0,0 +1,331 @@
+""" Benchmark suite for minhashing and LSH entry points.
+
+Each case runs in a fresh interpreter so peak RSS is measured per case,
+timings are the best of a number of repeats and results are written as
+JSON to compare across commits with compare.py.
+
+Usage:
+    python benchmarks/suite.py --texts 10000 --output results.json
+    python benchmarks/suite.py --cases lsh_query lsh_query_many
+
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import akin
+from akin import LSH, KMinHash, UniMinHash
+
+from corpus import generate_corpus
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _peak_rss_mb():
+    """ Returns peak resident set size of the current process in MB.
+
+    Returns:
+        float: Peak RSS, None where the resource module is unavailable.
+
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def _timed(function, repeats):
+    """ Times a function, returning its best time and last result.
+
+    Args:
+        function (callable): Function to time, called without arguments.
+        repeats (int): Number of times to run the function.
+
+    Returns:
+        tuple: Best time in seconds and result of the last run.
+
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def _corpus(config):
+    return generate_corpus(
+        n_texts=config['texts'],
+        text_length=config['text_length'],
+        near_duplicate_rate=config['near_duplicate_rate'],
+        mutation_rate=config['mutation_rate'],
+        seed=config['seed']
+    )
+
+
+def _minhash_params(config):
+    return dict(
+        n_gram=config['n_gram'],
+        permutations=config['permutations'],
+        seed=config['seed']
+    )
+
+
+def _model(config):
+    """ Builds an LSH model of the benchmark corpus.
+
+    Args:
+        config (dict): Benchmark configuration.
+
+    Returns:
+        tuple: LSH model, corpus signatures and near duplicate sources.
+
+    """
+    texts, sources = _corpus(config)
+    minhash = KMinHash(method='universal', **_minhash_params(config))
+    signatures = minhash.transform(texts)
+
+    lsh = LSH(
+        config['permutations'],
+        config['no_of_bands'],
+        config['seed'],
+        estimator=KMinHash.estimator,
+        threshold=config['threshold']
+    )
+    lsh.update(signatures, range(len(signatures)))
+
+    return lsh, signatures, sources
+
+
+def _query_labels(config, sources):
+    """ Selects query labels, near duplicates first so recall is measured.
+
+    Args:
+        config (dict): Benchmark configuration.
+        sources (list): Source text index of each near duplicate.
+
+    Returns:
+        list: Labels to query.
+
+    """
+    near_duplicates = [index for index, source in enumerate(sources) if source >= 0]
+    others = [index for index, source in enumerate(sources) if source < 0]
+    return (near_duplicates + others)[:config['queries']]
+
+
+def _transform_case(minhash, config):
+    texts, _ = _corpus(config)
+    texts = texts[:config['transform_texts']]
+    seconds, _ = _timed(lambda: minhash.transform(texts), config['repeats'])
+    return {'seconds': seconds, 'docs_per_sec': len(texts) / seconds}
+
+
+def transform_multi_hash(config):
+    return _transform_case(KMinHash(**_minhash_params(config)), config)
+
+
+def transform_universal(config):
+    return _transform_case(
+        KMinHash(method='universal', **_minhash_params(config)), config
+    )
+
+
+def transform_bottom_k(config):
+    return _transform_case(UniMinHash(**_minhash_params(config)), config)
+
+
+def lsh_update(config):
+    _, signatures, _ = _model(config)
+
+    def update():
+        lsh = LSH(
+            config['permutations'],
+            config['no_of_bands'],
+            config['seed'],
+            estimator=KMinHash.estimator,
+            threshold=config['threshold']
+        )
+        lsh.update(signatures, range(len(signatures)))
+
+    seconds, _ = _timed(update, config['repeats'])
+    return {'seconds': seconds, 'docs_per_sec': len(signatures) / seconds}
+
+
+def lsh_query(config):
+    lsh, _, sources = _model(config)
+    labels = _query_labels(config, sources)
+
+    seconds, results = _timed(
+        lambda: [lsh.query(label, min_jaccard=config['min_jaccard']) for label in labels],
+        config['repeats']
+    )
+
+    rows = np.array([lsh.keys[label] for label in labels])
+    _, _, counts = lsh._candidates(lsh._signatures[rows], rows)
+
+    near_duplicates = [
+        (label, sources[label]) for label in labels if sources[label] >= 0
+    ]
+    found = sum(
+        source in result
+        for (label, source), result in zip(near_duplicates, results)
+    )
+
+    return {
+        'seconds': seconds,
+        'queries_per_sec': len(labels) / seconds,
+        'candidates_per_query': len(counts) / len(labels),
+        'recall': found / len(near_duplicates) if near_duplicates else None,
+    }
+
+
+def lsh_query_many(config):
+    lsh, _, sources = _model(config)
+    labels = _query_labels(config, sources)
+
+    seconds, _ = _timed(
+        lambda: lsh.query_many(labels, min_jaccard=config['min_jaccard']),
+        config['repeats']
+    )
+    return {'seconds': seconds, 'queries_per_sec': len(labels) / seconds}
+
+
+def lsh_adjacency_list(config):
+    lsh, signatures, _ = _model(config)
+
+    seconds, adjacency_list = _timed(
+        lambda: lsh.adjacency_list(min_jaccard=config['min_jaccard']),
+        config['repeats']
+    )
+    return {
+        'seconds': seconds,
+        'docs_per_sec': len(signatures) / seconds,
+        'near_duplicates_per_doc': (
+            sum(map(len, adjacency_list.values())) / len(adjacency_list)
+        ),
+    }
+
+
+def lsh_near_duplicate_pairs(config):
+    lsh, signatures, _ = _model(config)
+
+    seconds, pairs = _timed(
+        lambda: list(lsh.near_duplicate_pairs(min_jaccard=config['min_jaccard'])),
+        config['repeats']
+    )
+    return {
+        'seconds': seconds,
+        'docs_per_sec': len(signatures) / seconds,
+        'pairs': len(pairs),
+    }
+
+
+CASES = {
+    'transform_multi_hash': transform_multi_hash,
+    'transform_universal': transform_universal,
+    'transform_bottom_k': transform_bottom_k,
+    'lsh_update': lsh_update,
+    'lsh_query': lsh_query,
+    'lsh_query_many': lsh_query_many,
+    'lsh_adjacency_list': lsh_adjacency_list,
+    'lsh_near_duplicate_pairs': lsh_near_duplicate_pairs,
+}
+
+
+def run_case(name, config):
+    """ Runs a benchmark case and records peak memory.
+
+    Args:
+        name (str): Name of the case in CASES.
+        config (dict): Benchmark configuration.
+
+    Returns:
+        dict: Metrics of the case.
+
+    """
+    metrics = CASES[name](config)
+    metrics['peak_rss_mb'] = _peak_rss_mb()
+    return metrics
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--texts', type=int, default=10000)
+    parser.add_argument(
+        '--transform-texts', type=int, default=1000,
+        help='Number of texts minhashed by transform cases.'
+    )
+    parser.add_argument('--text-length', type=int, default=200)
+    parser.add_argument('--near-duplicate-rate', type=float, default=0.2)
+    parser.add_argument('--mutation-rate', type=float, default=0.1)
+    parser.add_argument('--n-gram', type=int, default=9)
+    parser.add_argument('--permutations', type=int, default=100)
+    parser.add_argument('--no-of-bands', type=int, default=None)
+    parser.add_argument('--threshold', type=float, default=None)
+    parser.add_argument('--min-jaccard', type=float, default=0.5)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='JSON file to write results to.')
+    config = vars(parser.parse_args())
+    cases = config.pop('cases')
+    output = config.pop('output')
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for name in cases:
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(run_case, (name, config))
+
+        metrics = ', '.join(
+            f'{metric}={value:.4g}' if isinstance(value, float) else f'{metric}={value}'
+            for metric, value in results[name].items()
+        )
+        print(f'{name}: {metrics}')
+
+    report = {
+        'metadata': {
+            'commit': _commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'akin': getattr(akin, '__version__', None),
+            'config': config,
+        },
+        'results': results,
+    }
+
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
+import numpy as np
 import pytest
-from akin import DictionaryArray
+from akin import DictionaryArray, FrozenDictionaryArray
 
 
 def test_array_1():
@@ -132,3 +133,87 @@ def test_get_values():
         'test_value_one',
         100
     }
+
+
+def test_get_many():
+    dictionary_array = DictionaryArray(5)
+
+    dictionary_array._hash_arrays = test_array_1()
+
+    assert dictionary_array.get_many(3, ['test_key', 'missing_key', 'test_key_two']) == [
+        {'test_value', 'test_value_two'},
+        set(),
+        {'test_value_one'}
+    ]
+    assert dictionary_array.get_many(4, []) == []
+
+
+def test_items():
+    dictionary_array = DictionaryArray(5)
+
+    dictionary_array._hash_arrays = test_array_1()
+
+    assert list(dictionary_array.items(3)) == [
+        ('test_key', {'test_value', 'test_value_two'}),
+        ('test_key_two', {'test_value_one'})
+    ]
+    assert list(dictionary_array.items(0)) == []
+
+
+def test_frozen_dictionary_array():
+    dictionary_array = DictionaryArray(3)
+    dictionary_array._hash_arrays = [
+        {5: {3, 1}, -2: {7}},
+        {},
+        {9: {1, 2, 3}},
+    ]
+
+    frozen_array = FrozenDictionaryArray.from_dictionary_array(dictionary_array)
+    assert frozen_array.n_arrays == 3
+    assert frozen_array.arrays()['values'].dtype == np.int32
+
+    assert frozen_array.get(0, 5).tolist() == [1, 3]
+    assert frozen_array.get(2, 9).tolist() == [1, 2, 3]
+    with pytest.raises(KeyError):
+        frozen_array.get(1, 5)
+
+    buckets = frozen_array.get_many(0, [-2, 4, 5, 100])
+    assert [bucket.tolist() for bucket in buckets] == [[7], [], [1, 3], []]
+
+    assert [(key, values.tolist()) for key, values in frozen_array.items(0)] == [
+        (-2, [7]), (5, [1, 3])
+    ]
+    assert frozen_array.values() == {1, 2, 3, 7}
+    assert frozen_array.to_dictionary_array()._hash_arrays == dictionary_array._hash_arrays
+
+
+def test_frozen_dictionary_array_delta():
+    dictionary_array = DictionaryArray(2)
+    dictionary_array._hash_arrays = [{5: {3, 1}, -2: {7}}, {}]
+
+    frozen_array = FrozenDictionaryArray.from_dictionary_array(dictionary_array)
+    assert not frozen_array.pending
+
+    frozen_array.update(0, 5, 4)
+    frozen_array.update(0, 5, 3)
+    frozen_array.update(1, 8, 2)
+    frozen_array.remove_value(0, -2, 7)
+    assert frozen_array.pending
+
+    assert sorted(frozen_array.get(0, 5).tolist()) == [1, 3, 4]
+    assert frozen_array.get_many(0, [-2])[0].tolist() == []
+    assert frozen_array.get(1, 8).tolist() == [2]
+    assert [(key, sorted(values.tolist())) for key, values in frozen_array.items(0)] == [(5, [1, 3, 4])]
+    assert frozen_array.values() == {1, 2, 3, 4}
+
+    frozen_array.remove_value(0, 5, 4)
+    frozen_array.update(0, -2, 7)
+    with pytest.raises(KeyError):
+        frozen_array.remove_value(0, 5, 100)
+
+    frozen_array.update(0, 6, 9)
+    frozen_array.merge()
+    assert not frozen_array.pending
+    assert frozen_array.to_dictionary_array()._hash_arrays == [
+        {5: {3, 1}, -2: {7}, 6: {9}}, {8: {2}}
+    ]
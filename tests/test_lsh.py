@@ -1,6 +1,9 @@
+import numpy as np
+import pickle
 import pytest
 import mmh3
-from akin import MultiHash, LSH, DictionaryArray
+from akin import KMinHash as MultiHash, LSH, DictionaryArray
+from akin import FrozenDictionaryArray, KMinHash
 
 seed = 3
 labels = [1, 2, 3, 4, 5, 6, 7, 8, 9]
@@ -40,7 +43,7 @@ def test_lsh_init_params():
 
 
 def test_lsh_lsh():
-    lsh = LSH(no_of_bands=5, permutations=9)
+    lsh = LSH(no_of_bands=5, permutations=9, hash_version=1)
     signature = (45, 48, 21, 13, 29, 87, 43, 32, 12)
     bands = lsh._lsh(signature)
     bands = [band for band in bands]
@@ -55,7 +58,7 @@ def test_lsh_lsh():
 
     assert bands == expected_bands
 
-    lsh = LSH(no_of_bands=5, permutations=10, seed=2)
+    lsh = LSH(no_of_bands=5, permutations=10, seed=2, hash_version=1)
     signature = (45, 48, 21, 13, 29, 87, 43, 32, 12, 10)
     bands = lsh._lsh(signature)
     bands = [band for band in bands]
@@ -376,3 +379,736 @@ def test_adjacency_list():
     }
 
     assert lsh.adjacency_list(min_jaccard=0.6) == expected_adjacency_list
+
+
+def test_update_from_transform_iter():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    stream_labels = iter(range(len(content)))
+
+    lsh = LSH(permutations=20, no_of_bands=10)
+    for batch in k_minhash.transform_iter(iter(content), batch_size=3):
+        lsh.update(batch, stream_labels)
+
+    expected_lsh = LSH(permutations=20, no_of_bands=10)
+    expected_lsh.update(k_minhash.transform(content), range(len(content)))
+
+    assert list(lsh.keys) == list(range(len(content)))
+    for label in range(len(content)):
+        assert lsh.query(label) == expected_lsh.query(label)
+
+
+def test_signature_store():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    store_signatures = k_minhash.transform(content)
+
+    lsh = LSH(permutations=20, no_of_bands=10)
+    lsh.update(store_signatures, labels + [10])
+
+    assert lsh._signatures.dtype == np.int64
+    assert lsh.keys == {label: row for row, label in enumerate(labels + [10])}
+    assert tuple(lsh.get_signature(3).tolist()) == store_signatures[2]
+
+    lsh.remove([2, 5])
+    assert sorted(lsh._free_rows) == [1, 4]
+    assert lsh.query(1, min_jaccard=0.45) == [8, 4]
+    assert lsh.query(3) == []
+
+    lsh.update(store_signatures[1:2], ['doc2'])
+    assert lsh.keys['doc2'] in (1, 4)
+    assert tuple(lsh.get_signature('doc2').tolist()) == store_signatures[1]
+    assert lsh._n_rows == 10
+
+    large_lsh = LSH(permutations=20, no_of_bands=10)
+    large_lsh.update(store_signatures * 300, range(3000))
+    assert large_lsh._signatures.shape == (3000, 20)
+    large_lsh.update(store_signatures[:1], [3000])
+    assert large_lsh._signatures.shape == (6000, 20)
+    assert (large_lsh.get_signature(2999) == large_lsh.get_signature(9)).all()
+
+
+def test_batch_jaccard_similarity():
+    query_signature = np.array([13435, 54564, 54623, 41224, 21813, 13435])
+    candidate_signatures = np.array([
+        [13435, 54564, 54623, 41224, 21813, 21813],
+        [13435, 54564, 54621, 41224, 21813, 10000],
+        [65435, 45435, 54545, 45876, 22312, 22312],
+        [65435, 65435, 65435, 65435, 15435, 13435],
+    ])
+
+    similarities = LSH._batch_jaccard_similarity(query_signature, candidate_signatures)
+    expected_similarities = [
+        LSH._jaccard_similarity(query_signature, candidate)
+        for candidate in candidate_signatures
+    ]
+
+    assert similarities.tolist() == expected_similarities
+
+
+def test_vectorized_candidate_duplicates():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    lsh = LSH(permutations=20, no_of_bands=10)
+    lsh.update(k_minhash.transform(content), labels + [10])
+
+    query_signatures = np.array([lsh.get_signature(1)])
+    candidate_labels = labels[1:] + [10]
+    candidate_rows = np.array([lsh.keys[label] for label in candidate_labels])
+    query_ids = np.zeros(len(candidate_rows), dtype=np.int64)
+    counts = np.ones(len(candidate_rows), dtype=np.int64)
+
+    matches = lsh._to_labels(1, *lsh._candidate_duplicates(
+        query_signatures, query_ids, candidate_rows, counts, include_similarity=True
+    ), include_similarity=True)
+    assert matches == [[
+        (LSH._jaccard_similarity(query_signatures[0], lsh.get_signature(label)), label)
+        for label in candidate_labels
+    ]]
+
+    query_ids, rows, _ = lsh._candidate_duplicates(
+        query_signatures, query_ids, candidate_rows, counts, jaccard_threshold=0.45
+    )
+    assert query_ids.tolist() == [0, 0]
+    assert rows.tolist() == [lsh.keys[4], lsh.keys[8]]
+
+
+def test_positional_estimator():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+
+    lsh = LSH(permutations=20, no_of_bands=10, estimator=k_minhash.estimator)
+    assert lsh.estimator == 'positional'
+    lsh.update(k_signatures, labels + [10])
+
+    query_signature = np.array(k_signatures[0])
+    expected_similarities = [
+        sum(a == b for a, b in zip(k_signatures[0], candidate)) / 20
+        for candidate in k_signatures
+    ]
+    similarities = lsh._estimate_similarity(query_signature, np.array(k_signatures))
+    assert similarities.tolist() == expected_similarities
+
+    for similarity, label in lsh.query(1, include_similarity=True):
+        assert similarity == expected_similarities[label - 1]
+
+    assert lsh.query(9, min_jaccard=1.0) == [10]
+
+    with pytest.raises(ValueError):
+        LSH(permutations=20, estimator='cosine')
+
+
+def test_query_many():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+
+    lsh = LSH(permutations=20, no_of_bands=10)
+    lsh.update(k_signatures[:-1], labels)
+
+    expected = [lsh.query(label, min_jaccard=0.4, include_similarity=True) for label in labels]
+    assert lsh.query_many(labels, min_jaccard=0.4, include_similarity=True) == expected
+    assert lsh.query_many([1, 3]) == [lsh.query(1), lsh.query(3)]
+    assert lsh.query_many([]) == []
+
+    # Unindexed signatures are compared without being inserted.
+    assert lsh.query_many([k_signatures[-1]]) == [[9]]
+    assert lsh.query_many(np.array(k_signatures[-1:]), min_jaccard=1.0) == [[9]]
+    assert lsh.query_many([1, k_signatures[0]]) == [[8, 4], [1, 8, 4]]
+    assert 10 not in lsh.keys
+
+    # Co-occurrence counts are used for sensitivity.
+    assert lsh.query_many([9], sensitivity=10) == [[]]
+    lsh.update(k_signatures[-1:], [10])
+    assert lsh.query_many([9], sensitivity=10) == [[10]]
+
+    with pytest.raises(KeyError):
+        lsh.query_many(['missing'])
+
+    with pytest.raises(ValueError):
+        lsh.query_many(labels, sensitivity=11)
+
+
+def test_band_hashing():
+    lsh = LSH(no_of_bands=5, permutations=9)
+    assert lsh.hash_version == 2
+
+    batch = np.array([
+        (45, 48, 21, 13, 29, 87, 43, 32, 12),
+        (45, 48, 21, 13, 29, 87, 43, 32, 11),
+        (-1, 48, 21, 13, 29, 87, 43, 32, 12),
+    ])
+    band_hashes = lsh._lsh_batch(batch)
+    assert band_hashes.shape == (3, 5)
+    assert band_hashes.dtype == np.int64
+    assert band_hashes[0].tolist() == lsh._lsh(tuple(batch[0].tolist()))
+
+    # Only the band containing the changed value changes bucket.
+    assert (band_hashes[0] == band_hashes[1]).tolist() == [True, True, True, True, False]
+    assert (band_hashes[0] == band_hashes[2]).tolist() == [False, True, True, True, True]
+
+    reseeded_hashes = LSH(no_of_bands=5, permutations=9, seed=2)._lsh_batch(batch)
+    assert not (reseeded_hashes == band_hashes).any()
+
+    large_values = np.array([[1 << 100, 1 << 64, 3, 4]], dtype=object)
+    large_hashes = LSH(no_of_bands=2, permutations=4)._lsh_batch(large_values)
+    assert large_hashes.shape == (1, 2)
+    assert large_hashes[0, 0] != LSH(no_of_bands=2, permutations=4)._lsh_batch(
+        np.array([[0, 0, 3, 4]], dtype=object)
+    )[0, 0]
+
+    with pytest.raises(ValueError):
+        LSH(permutations=9, hash_version=3)
+
+
+def test_hash_versions():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+
+    results = []
+    for hash_version in [1, 2]:
+        lsh = LSH(permutations=20, no_of_bands=10, hash_version=hash_version)
+        lsh.update(k_signatures, labels + [10])
+        results.append(lsh.query_many(labels + [10], min_jaccard=0.3))
+
+    assert results[0] == results[1]
+
+
+def test_unpickle_legacy_model():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+
+    legacy_lsh = LSH.__new__(LSH)
+    legacy_lsh.__setstate__({
+        'no_of_bands': 10,
+        'seed': 1,
+        'permutations': 20,
+        'keys': dict(zip(labels + [10], k_signatures)),
+    })
+
+    assert legacy_lsh.hash_version == 1
+    assert legacy_lsh.query(1, min_jaccard=0.45) == [8, 4]
+
+    lsh = pickle.loads(pickle.dumps(legacy_lsh))
+    assert lsh.hash_version == 1
+    assert lsh.query(9) == [10]
+
+
+def test_parallel_adjacency_list():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    lsh = LSH(permutations=20, no_of_bands=10)
+    lsh.update(k_minhash.transform(content), labels + [10])
+
+    serial_adjacency_list = lsh.adjacency_list(min_jaccard=0.3)
+    parallel_adjacency_list = lsh.adjacency_list(min_jaccard=0.3, n_jobs=2, shard_size=3)
+
+    assert parallel_adjacency_list == serial_adjacency_list
+    assert list(parallel_adjacency_list) == list(serial_adjacency_list)
+    assert lsh.adjacency_list(labels=[1, 9], n_jobs=2) == lsh.adjacency_list(labels=[1, 9])
+
+
+def test_near_duplicate_pairs():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    lsh = LSH(permutations=20, no_of_bands=10)
+    lsh.update(k_minhash.transform(content), labels + [10])
+
+    for sensitivity in [1, 2]:
+        for min_jaccard in [None, 0.4]:
+            adjacency_list = lsh.adjacency_list(min_jaccard=min_jaccard, sensitivity=sensitivity)
+            expected_pairs = {
+                frozenset((label, neighbour))
+                for label, neighbours in adjacency_list.items() for neighbour in neighbours
+            }
+
+            pairs = list(lsh.near_duplicate_pairs(min_jaccard, sensitivity, batch_size=2))
+            assert len(pairs) == len(expected_pairs)
+            assert {frozenset(pair) for pair in pairs} == expected_pairs
+
+    assert set(lsh.candidate_pairs()) == set(lsh.near_duplicate_pairs())
+
+    for first, second, similarity in lsh.near_duplicate_pairs(include_similarity=True):
+        assert (similarity, second) in lsh.query(first, include_similarity=True)
+
+    with pytest.raises(ValueError):
+        list(lsh.near_duplicate_pairs(sensitivity=11))
+
+
+def test_candidate_pair_partitions():
+    signatures = np.arange(30 * 4).reshape(30, 4)
+    signatures[:, :2] = 1
+    signatures[10:20, 2:] = 2
+
+    lsh = LSH(permutations=4, no_of_bands=2)
+    lsh.update(signatures, range(30))
+
+    partitions = list(lsh._candidate_pair_rows(max_pairs=50))
+    assert len(partitions) > 1
+    assert all(len(first_rows) <= 50 for first_rows, _ in partitions)
+
+    first_rows, second_rows = map(np.concatenate, zip(*partitions))
+    (expected_first, expected_second), = lsh._candidate_pair_rows(max_pairs=10 ** 6)
+    assert first_rows.tolist() == expected_first.tolist()
+    assert second_rows.tolist() == expected_second.tolist()
+    assert len(first_rows) == 30 * 29 // 2
+
+    sensitive_pairs = list(lsh._candidate_pair_rows(sensitivity=2, max_pairs=50))
+    assert sum(len(first_rows) for first_rows, _ in sensitive_pairs) == 10 * 9 // 2
+
+
+def test_save_load(tmp_path):
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+
+    lsh = LSH(permutations=20, no_of_bands=10, estimator='positional')
+    lsh.update(k_signatures, labels + ['doc10'])
+    lsh.remove([2])
+    lsh.save(tmp_path / 'model')
+
+    expected = lsh.query_many(lsh.keys, min_jaccard=0.3, include_similarity=True)
+
+    mapped_lsh = LSH.load(tmp_path / 'model')
+    assert isinstance(mapped_lsh._signatures, np.memmap)
+    assert isinstance(mapped_lsh._buckets, FrozenDictionaryArray)
+    assert mapped_lsh.estimator == 'positional'
+    assert list(mapped_lsh.keys) == list(lsh.keys)
+    assert mapped_lsh.query_many(mapped_lsh.keys, min_jaccard=0.3, include_similarity=True) == expected
+    assert mapped_lsh.query_many([k_signatures[1]]) == lsh.query_many([k_signatures[1]])
+    assert mapped_lsh.adjacency_list() == lsh.adjacency_list()
+    assert set(mapped_lsh.near_duplicate_pairs()) == set(lsh.near_duplicate_pairs())
+
+    mapped_lsh.update(k_signatures[1:2], [2])
+    assert mapped_lsh.query(3, min_jaccard=0.5) == [5]
+    assert isinstance(mapped_lsh._buckets, FrozenDictionaryArray)
+
+    loaded_lsh = LSH.load(tmp_path / 'model', mmap=False)
+    assert isinstance(loaded_lsh._buckets, DictionaryArray)
+    loaded_lsh.update(k_signatures[1:2], [2])
+    loaded_lsh.remove(['doc10'])
+    assert loaded_lsh.query(9) == []
+    assert loaded_lsh.query(1, min_jaccard=0.45) == lsh.query(1, min_jaccard=0.45)
+
+    large_minhash = KMinHash(seed=seed, permutations=20, hash_bits=128)
+    large_lsh = LSH(permutations=20, no_of_bands=10)
+    large_lsh.update(large_minhash.transform(content), labels + [10])
+    large_lsh.save(tmp_path / 'large_model')
+    assert LSH.load(tmp_path / 'large_model').query(9) == [10]
+
+
+def test_freeze():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+
+    lsh = LSH(permutations=20, no_of_bands=10)
+    lsh.update(k_signatures[:-1], labels)
+    expected = lsh.query_many(labels, min_jaccard=0.3, include_similarity=True)
+
+    lsh.freeze()
+    assert isinstance(lsh._buckets, FrozenDictionaryArray)
+    assert lsh._buckets.arrays()['values'].dtype == np.int32
+    assert lsh.query_many(labels, min_jaccard=0.3, include_similarity=True) == expected
+
+    # Writes go to the delta until the buckets are frozen again.
+    lsh.update(k_signatures[-1:], [10])
+    lsh.remove([8])
+    assert lsh._buckets.pending
+    assert lsh.query(9) == [10]
+    assert lsh.query(1, min_jaccard=0.45) == [4]
+    assert set(lsh.near_duplicate_pairs()) == {(9, 10), (1, 4), (3, 5)}
+    assert lsh.get_minhashes() == set(labels + [10]) - {8}
+
+    lsh.freeze()
+    assert not lsh._buckets.pending
+    assert lsh.query(9) == [10]
+    assert lsh.query(1, min_jaccard=0.45) == [4]
+
+
+def test_label_interning():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+    url_labels = [f'https://example.com/documents/{label}' for label in labels + [10]]
+
+    lsh = LSH(permutations=20, no_of_bands=10)
+    lsh.update(k_signatures, url_labels)
+
+    assert lsh.keys == {label: row for row, label in enumerate(url_labels)}
+    assert lsh._labels == url_labels
+    for band_id in range(lsh.no_of_bands):
+        for _, bucket in lsh._buckets.items(band_id):
+            assert all(isinstance(row, int) for row in bucket)
+
+    assert lsh.query(url_labels[0], min_jaccard=0.45) == [url_labels[7], url_labels[3]]
+
+    adjacency_list = lsh.adjacency_list(min_jaccard=0.45)
+    assert list(adjacency_list) == url_labels
+    assert adjacency_list == {label: lsh.query(label, min_jaccard=0.45) for label in url_labels}
+    assert lsh.adjacency_list(min_jaccard=0.45, n_jobs=2) == adjacency_list
+
+
+def test_wide_integer_signatures():
+    signatures = np.arange(3 * 20, dtype=np.uint64).reshape(3, 20) + np.uint64(2 ** 63)
+    signatures[1, :10] = signatures[0, :10]
+    python_signatures = [tuple(int(value) for value in row) for row in signatures]
+
+    lsh = LSH(permutations=20, no_of_bands=10, estimator='positional')
+    lsh.update(python_signatures, [0, 1, 2])
+    assert lsh._signatures.dtype == np.uint64
+    assert lsh.query(0) == [1]
+    assert lsh.query_many([0, list(python_signatures[1])]) == [[1], [0, 1]]
+
+    with pytest.raises(ValueError):
+        lsh.query_many([[0.5] * 20])
+
+    with pytest.raises(ValueError):
+        lsh.update(np.ones((1, 20)), [3])
+
+
+def test_uneven_bands():
+    k_minhash = KMinHash(seed=seed, permutations=20)
+    k_signatures = k_minhash.transform(content)
+
+    for no_of_bands in [6, 8]:
+        lsh = LSH(permutations=20, no_of_bands=no_of_bands, estimator='positional')
+        assert lsh._n_bands == len(lsh._lsh(k_signatures[0])) < no_of_bands
+        lsh.update(k_signatures, labels + [10])
+
+        similarities = sorted(similarity for similarity, _ in lsh.query(1, include_similarity=True))
+        top_k = lsh.query(1, top_k=2, include_similarity=True)
+        assert [similarity for similarity, _ in top_k] == similarities[::-1][:2]
+
+        with pytest.raises(ValueError):
+            lsh.query(1, sensitivity=no_of_bands)
+
+        with pytest.raises(ValueError):
+            list(lsh.near_duplicate_pairs(sensitivity=no_of_bands))
+
+        assert lsh.query(9, sensitivity=lsh._n_bands) == [10]
+
+        row = lsh.keys[4]
+        lsh.remove([4])
+        assert 4 not in lsh.query(1)
+        assert all(
+            row not in bucket
+            for band_id in range(lsh.no_of_bands) for _, bucket in lsh._buckets.items(band_id)
+        )
+
+
+def test_mixed_dtype_updates(tmp_path):
+    universal_signatures = KMinHash(seed=seed, permutations=20, method='universal').transform(content)
+
+    expected_lsh = LSH(permutations=20, no_of_bands=10, estimator='positional')
+    expected_lsh.update(universal_signatures, labels + [10])
+    expected = expected_lsh.query_many(labels + [10])
+
+    lsh = LSH(permutations=20, no_of_bands=10, estimator='positional')
+    lsh.update(universal_signatures[:5].tolist(), labels[:5])
+    lsh.update(universal_signatures[5:], labels[5:] + [10])
+    assert lsh._signatures.dtype == np.int64
+    assert lsh.query_many(labels + [10]) == expected
+    lsh.remove([1])
+    assert 1 not in lsh.query(4)
+
+    lsh.save(tmp_path / 'model')
+    loaded_lsh = LSH.load(tmp_path / 'model')
+    loaded_lsh.update([universal_signatures[0].tolist()], [1])
+    assert loaded_lsh.query(1) == expected[0]
+
+    wide_signatures = np.arange(2 * 20, dtype=np.uint64).reshape(2, 20) + np.uint64(2 ** 63)
+    mixed_lsh = LSH(permutations=20, no_of_bands=10, estimator='positional')
+    mixed_lsh.update(KMinHash(seed=seed, permutations=20).transform(content), labels + [10])
+    mixed_lsh.update(np.vstack([wide_signatures, wide_signatures]), ['a', 'b', 'c', 'd'])
+    assert mixed_lsh._signatures.dtype == object
+    assert mixed_lsh.query(9) == [10]
+    assert mixed_lsh.query('a') == ['c']
+    mixed_lsh.remove([10, 'c'])
+    assert mixed_lsh.query(9) == []
+    assert mixed_lsh.query('a') == []
+
+
+def test_batch_update_is_atomic():
+    lsh = LSH(permutations=4, no_of_bands=2)
+    lsh.update([(1, 2, 3, 4), (5, 6, 7, 8)], [0, 1])
+
+    with pytest.raises(KeyError):
+        lsh.update([(1, 2, 3, 9), (9, 9, 9, 9)], [2, 0])
+
+    with pytest.raises(KeyError):
+        lsh.update([(1, 2, 3, 9), (9, 9, 9, 9)], [3, 3])
+
+    assert set(lsh.keys) == {0, 1}
+    assert lsh.query(0) == []
+    assert sorted(lsh.get_minhashes()) == [0, 1]
+
+    lsh.update(np.array([(1, 2, 9, 9), (5, 6, 7, 8)]), iter([2, 3, 4]))
+    assert lsh.query(0) == [2]
+    assert lsh.query(1) == [3]
+
+    frozen_lsh = LSH(permutations=4, no_of_bands=2)
+    frozen_lsh.update([(1, 2, 3, 4), (5, 6, 7, 8)], [0, 1])
+    frozen_lsh.freeze()
+    frozen_lsh.remove([1])
+    frozen_lsh.update([(5, 6, 7, 8), (1, 2, 9, 9)], [1, 2])
+    assert frozen_lsh.query(0) == [2]
+    assert frozen_lsh.get_signature(1).tolist() == [5, 6, 7, 8]
+
+
+def test_lazy_remove():
+    signatures = [(1, 2, 3, 4), (1, 2, 3, 5), (1, 2, 7, 8), (9, 9, 9, 9)]
+    lsh = LSH(permutations=4, no_of_bands=2, compact_threshold=0.5)
+    lsh.update(signatures, [0, 1, 2, 3])
+
+    lsh.remove([1], lazy=True)
+    assert lsh._tombstones == [1]
+    assert lsh.query(0) == [2]
+    assert lsh.query_many([signatures[1]]) == [[0, 2]]
+    assert sorted(lsh.get_minhashes()) == [0, 2, 3]
+    assert list(lsh.candidate_pairs()) == [(0, 2)]
+    assert lsh._free_rows == []
+
+    with pytest.raises(KeyError):
+        lsh.remove([1], lazy=True)
+
+    lsh.remove([3], lazy=True)
+    assert lsh._tombstones == []
+    assert sorted(lsh._free_rows) == [1, 3]
+    assert lsh._buckets._hash_arrays[1] == {lsh._lsh(signatures[0])[1]: {0}, lsh._lsh(signatures[2])[1]: {2}}
+
+    lsh.update(signatures[1:2], [1])
+    assert lsh.query(0) == [2, 1]
+
+    frozen_lsh = LSH(permutations=4, no_of_bands=2)
+    frozen_lsh.update(signatures, [0, 1, 2, 3])
+    frozen_lsh.freeze()
+    frozen_lsh.remove([0], lazy=True)
+    assert frozen_lsh.query(1) == [2]
+    frozen_lsh.compact()
+    frozen_lsh.freeze()
+    assert frozen_lsh.query(1) == [2]
+    assert sorted(frozen_lsh.get_minhashes()) == [1, 2, 3]
+
+
+def test_top_k_query():
+    rng = np.random.default_rng(3)
+    base = rng.integers(0, 2 ** 40, size=20)
+    signatures = np.tile(base, (60, 1))
+    for row, n_changed in enumerate(rng.integers(1, 20, size=60)):
+        signatures[row, rng.choice(20, size=n_changed, replace=False)] = rng.integers(0, 2 ** 40, size=n_changed)
+
+    for estimator in ['set', 'positional']:
+        lsh = LSH(permutations=20, no_of_bands=10, estimator=estimator)
+        lsh.update(signatures, range(60))
+
+        for label in [0, 7, 31]:
+            everything = lsh.query(label, include_similarity=True)
+            ranked = sorted((ratio for ratio, _ in everything), reverse=True)
+
+            top = lsh.query(label, include_similarity=True, top_k=5)
+            assert [ratio for ratio, _ in top] == ranked[:5]
+            assert set(top) <= set(everything)
+            assert lsh.query(label, top_k=5) == [match for _, match in top]
+
+            top = lsh.query(label, min_jaccard=0.5, include_similarity=True, top_k=100)
+            assert [ratio for ratio, _ in top] == [ratio for ratio in ranked if ratio >= 0.5]
+
+        assert lsh.query_many([31, 7], top_k=3) == [lsh.query(31, top_k=3), lsh.query(7, top_k=3)]
+
+    with pytest.raises(ValueError):
+        lsh.query(0, top_k=0)
+
+
+def test_top_k_early_termination(monkeypatch):
+    signatures = np.arange(1000 * 8).reshape(1000, 8)
+    signatures[:, :2] = 1
+    signatures[:3] = signatures[999]
+
+    lsh = LSH(permutations=8, no_of_bands=4, estimator='positional')
+    lsh.update(signatures, range(1000))
+
+    monkeypatch.setattr('akin.lsh._TOP_K_CHUNK_SIZE', 4)
+    verified = []
+    estimate_similarity = lsh._estimate_similarity
+    monkeypatch.setattr(lsh, '_estimate_similarity', lambda query, candidates: verified.append(len(candidates)) or estimate_similarity(query, candidates))
+
+    assert lsh.query(999, top_k=3) == [0, 1, 2]
+    assert verified == [4]
+
+
+def test_top_k_capped_buckets(monkeypatch):
+    signatures = np.arange(306 * 8).reshape(306, 8) + 10
+    signatures[:302, :2] = [1, 2]
+    signatures[300:302, 2:4] = [3, 4]
+    signatures[302:, 2:5] = [3, 4, 5]
+    signatures[300, 4] = 5
+
+    monkeypatch.setattr('akin.lsh._TOP_K_CHUNK_SIZE', 2)
+    for max_bucket_size in [None, 250]:
+        lsh = LSH(permutations=8, no_of_bands=8, estimator='positional', max_bucket_size=max_bucket_size)
+        lsh.update(signatures, range(306))
+        assert max(lsh.query(300, include_similarity=True)) == (0.5, 301)
+        assert lsh.query(300, top_k=1, include_similarity=True) == [(0.5, 301)]
+
+
+def test_stop_buckets():
+    signatures = np.arange(40 * 4).reshape(40, 4)
+    signatures[:, :2] = 1
+    signatures[:2, 2:] = 5
+
+    lsh = LSH(permutations=4, no_of_bands=2, max_bucket_size=10)
+    lsh.update(signatures, range(40))
+    hot_bucket = lsh._lsh(signatures[0])[0]
+
+    assert lsh.stop_buckets() == [(0, hot_bucket, 40)]
+    assert lsh.stop_buckets(max_size=1) == [(0, hot_bucket, 40), (1, lsh._lsh(signatures[0])[1], 2)]
+    assert lsh.query(0) == [1]
+    assert lsh.query(5) == []
+    assert list(lsh.candidate_pairs()) == [(0, 1)]
+
+    lsh.freeze()
+    assert lsh.stop_buckets() == [(0, hot_bucket, 40)]
+    assert lsh.query(0) == [1]
+
+    sampled_lsh = LSH(permutations=4, no_of_bands=2, max_bucket_size=10, bucket_overflow='sample')
+    sampled_lsh.update(signatures, range(40))
+    assert sampled_lsh.query_many(signatures[5:6]) == [[0, 4, 8, 13, 17, 21, 26, 30, 34, 39, 5]]
+    assert sampled_lsh.query(4) == [0, 8, 13, 17, 21, 26, 30, 34, 39]
+
+    with pytest.raises(ValueError):
+        LSH(permutations=4, no_of_bands=2).stop_buckets()
+
+    with pytest.raises(ValueError):
+        LSH(permutations=4, no_of_bands=2, bucket_overflow='drop')
+
+
+def test_threshold_bands():
+    lsh = LSH(permutations=100, threshold=0.8)
+    assert (lsh.no_of_bands, lsh.rows_per_band) == (8, 12)
+    assert lsh._lsh_batch(np.arange(200).reshape(2, 100)).shape == (2, 8)
+
+    signatures = np.arange(200).reshape(2, 100)
+    signatures[1, :96] = signatures[0, :96]
+    assert lsh.query_many(signatures[:1]) == [[]]
+    lsh.update(signatures, ['a', 'b'])
+    assert lsh.query('a') == ['b']
+
+    wide_lsh = LSH(permutations=100, threshold=0.8, false_negative_weight=0.9, false_positive_weight=0.1)
+    assert wide_lsh.no_of_bands > lsh.no_of_bands
+
+    for params in [dict(threshold=0.8, no_of_bands=10), dict(threshold=1.5), dict(no_of_bands=10, rows_per_band=11)]:
+        with pytest.raises(ValueError):
+            LSH(permutations=100, **params)
+
+
+def test_tune_bands():
+    rng = np.random.default_rng(0)
+    signatures = np.repeat(rng.integers(0, 2 ** 40, size=(20, 50)), 10, axis=0)
+    changed = rng.random(signatures.shape) < rng.random((len(signatures), 1)) * 0.6
+    signatures[changed] = rng.integers(0, 2 ** 40, size=changed.sum())
+
+    results = LSH.tune_bands(signatures, 0.6, estimator='positional', n_configs=3)
+    assert len(results) == 3
+    assert [result['error'] for result in results] == sorted(result['error'] for result in results)
+    for result in results:
+        assert result['no_of_bands'] * result['rows_per_band'] <= 50
+        assert 0 < result['recall'] <= 1
+        assert 0 < result['precision'] <= 1
+        assert result['candidates_per_query'] > 0
+
+
+def test_query_metrics():
+    signatures = [(1, 2, 3, 4), (1, 2, 3, 5), (1, 2, 7, 8), (9, 9, 9, 9)]
+    calls = []
+    lsh = LSH(permutations=4, no_of_bands=2, metrics_callback=calls.append)
+    lsh.update(signatures, ['a', 'b', 'c', 'd'])
+
+    assert lsh.query('a', min_jaccard=0.5) == ['b']
+    metrics = calls[-1]
+    assert (metrics['queries'], metrics['buckets_probed'], metrics['buckets_hit']) == (1, 2, 2)
+    assert (metrics['rows_gathered'], metrics['candidates'], metrics['candidates_verified']) == (4, 2, 2)
+    assert metrics['near_duplicates'] == 1
+    assert metrics['total_seconds'] >= metrics['hash_seconds'] + metrics['verify_seconds']
+
+    lsh.query_many(['a', 'd'], top_k=1)
+    assert (calls[-1]['queries'], calls[-1]['candidates_verified'], calls[-1]['near_duplicates']) == (2, 2, 1)
+
+    lsh.adjacency_list()
+    assert len(calls) == 2
+    assert pickle.loads(pickle.dumps(lsh)).metrics_callback is None
+
+
+def test_stats():
+    signatures = np.arange(40 * 4).reshape(40, 4)
+    signatures[:, :2] = 1
+
+    lsh = LSH(permutations=4, no_of_bands=2)
+    lsh.update(signatures, range(40))
+    lsh.remove([3], lazy=True)
+
+    stats = lsh.stats(n_largest=2)
+    assert (stats['labels'], stats['tombstones'], stats['free_rows']) == (39, 1, 0)
+    assert stats['bands'][0] == {'buckets': 1, 'rows': 40, 'max_bucket_size': 40, 'histogram': {32: 1}}
+    assert stats['bands'][1]['histogram'] == {1: 40}
+    assert stats['largest_buckets'][0] == (0, lsh._lsh(signatures[0])[0], 40)
+    assert len(stats['largest_buckets']) == 2
+    assert stats['memory']['signatures'] == lsh._signatures.nbytes
+    assert stats['memory']['buckets'] > 0
+
+    lsh.freeze()
+    assert lsh.stats()['bands'] == stats['bands']
+    assert lsh.stats()['memory']['buckets'] < stats['memory']['buckets']
+
+
+def test_one_permutation_signatures():
+    from akin import OPHMinHash
+
+    one_permutation_hash = OPHMinHash(seed=seed, n_gram=5, permutations=100)
+    signatures = one_permutation_hash.transform(content)
+
+    lsh = LSH(permutations=100, no_of_bands=50, estimator=OPHMinHash.estimator)
+    lsh.update(signatures, labels)
+    assert 4 in lsh.query(1, min_jaccard=0.5)
+    assert lsh.query(1, min_jaccard=0.5) == lsh.query_many(signatures[:1], min_jaccard=0.5)[0][1:]
+
+
+def test_b_bit_signatures(tmp_path):
+    k_minhash = KMinHash(seed=seed, permutations=100)
+    k_signatures = np.array(k_minhash.transform(content))
+
+    full_lsh = LSH(permutations=100, no_of_bands=50, estimator='positional')
+    full_lsh.update(k_signatures, labels + [10])
+
+    lsh = LSH(permutations=100, no_of_bands=50, estimator='positional', b_bits=16)
+    lsh.update(k_signatures, labels + [10])
+    assert lsh._signatures.dtype == np.uint16
+    assert lsh.stats()['memory']['signatures'] * 4 == full_lsh.stats()['memory']['signatures']
+    assert lsh.get_signature(1).tolist() == (k_signatures[0] & 0xffff).tolist()
+
+    expected = dict(
+        (label, similarity)
+        for similarity, label in full_lsh.query(1, include_similarity=True)
+    )
+    near_duplicates = lsh.query(1, include_similarity=True)
+    assert near_duplicates
+    for similarity, label in near_duplicates:
+        assert abs(similarity - expected.get(label, 0)) < 0.02
+
+    assert lsh.query(1, min_jaccard=0.5) == full_lsh.query(1, min_jaccard=0.5)
+    assert lsh.query_many(k_signatures[:1])[0][1:] == lsh.query(1)
+    assert lsh.query(9, min_jaccard=1.0) == [10]
+
+    lsh.remove([4])
+    assert 4 not in lsh.query(1)
+    assert lsh.query(9, top_k=1) == [10]
+
+    lsh.save(tmp_path / 'model')
+    loaded_lsh = LSH.load(tmp_path / 'model')
+    assert loaded_lsh.b_bits == 16
+    assert loaded_lsh.query(1, include_similarity=True) == lsh.query(1, include_similarity=True)
+
+    with pytest.raises(ValueError):
+        LSH(permutations=100, estimator='positional', b_bits=4)
+
+    with pytest.raises(ValueError):
+        LSH(permutations=100, b_bits=8)
+
+    with pytest.raises(ValueError):
+        LSH(permutations=100, no_of_bands=50, estimator='positional', b_bits=8)
+
+    with pytest.raises(ValueError):
+        LSH(permutations=10, no_of_bands=4, estimator='positional', b_bits=16)
+
+    assert LSH(permutations=100, no_of_bands=25, estimator='positional', b_bits=8).b_bits == 8
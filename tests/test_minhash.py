@@ -1,3 +1,5 @@
+import heapq
+import numpy as np
 import pytest
 from akin import minhash
 
@@ -148,3 +150,160 @@ def test_minhash_errors():
     with pytest.raises(ValueError):
         multi_hash = minhash.MultiHash(n_gram=63)
         multi_hash.transform(content)
+
+
+def test_universal_minhash():
+    universal_hash = minhash.KMinHash(seed=seed, method='universal')
+    assert universal_hash.method == 'universal'
+
+    signatures = universal_hash.transform(content)
+    assert type(signatures) is np.ndarray
+    assert signatures.dtype == np.uint64
+    assert signatures.shape == (9, 100)
+    assert (signatures < (1 << 61) - 1).all()
+
+    repeat_hash = minhash.KMinHash(seed=seed, method='universal')
+    assert (repeat_hash.transform(content) == signatures).all()
+
+    # Near duplicate texts share more positions than unrelated texts.
+    assert (signatures[0] == signatures[3]).sum() > (signatures[0] == signatures[1]).sum()
+
+    with pytest.raises(ValueError):
+        minhash.KMinHash(method='bottom_k')
+
+
+def test_parallel_transform():
+    multi_hash = minhash.KMinHash(seed=seed, permutations=20)
+    serial_signatures = multi_hash.transform(content)
+    assert multi_hash.transform(content, n_jobs=2, chunk_size=2) == serial_signatures
+
+    bottom_k_hash = minhash.UniMinHash(seed=seed, permutations=20)
+    serial_signatures = bottom_k_hash.transform(content)
+    assert bottom_k_hash.transform(content, n_jobs=2) == serial_signatures
+
+    universal_hash = minhash.KMinHash(seed=seed, method='universal')
+    serial_signatures = universal_hash.transform(content)
+    parallel_signatures = universal_hash.transform(content, n_jobs=2, chunk_size=4)
+    assert (parallel_signatures == serial_signatures).all()
+
+
+def test_transform_iter():
+    multi_hash = minhash.KMinHash(seed=seed, permutations=20)
+    signatures = multi_hash.transform(content)
+
+    batches = list(multi_hash.transform_iter(iter(content), batch_size=4))
+    assert [batch.shape for batch in batches] == [(4, 20), (4, 20), (1, 20)]
+    assert [tuple(row) for row in np.vstack(batches).tolist()] == signatures
+
+    large_hash = minhash.KMinHash(seed=seed, permutations=20, hash_bits=128)
+    batch = next(large_hash.transform_iter(content))
+    assert batch.dtype == object
+    assert batch.shape == (9, 20)
+
+    with pytest.raises(ValueError):
+        next(multi_hash.transform_iter(content, batch_size=0))
+
+
+def test_k_smallest_hash_matches_heap():
+    for hash_size in [32, 64, 128]:
+        bottom_k_hash = minhash.UniMinHash(permutations=20, hash_bits=hash_size, seed=seed)
+        signatures = bottom_k_hash.transform(content + ['abab' * 40])
+
+        expected_signatures = [
+            tuple(heapq.nsmallest(20, [bottom_k_hash._hashing(shingle, seed) for shingle in document]))
+            for document in bottom_k_hash._k_shingles(content + ['abab' * 40])
+        ]
+
+        assert signatures == expected_signatures
+        assert all(type(value) is int for value in signatures[0])
+
+
+def test_buffer_shingling():
+    texts = content + ['Crème brûlée  costs 5 €, 日本語のテキスト  too.\n' * 4]
+    for hash_size in [32, 64, 128]:
+        for n_gram, n_gram_type in [(5, 'char'), (2, 'term'), (3, 'term')]:
+            params = dict(seed=seed, permutations=8, n_gram=n_gram, n_gram_type=n_gram_type, hash_bits=hash_size)
+
+            text_hash = minhash.UniMinHash(**params)
+            buffer_hash = minhash.UniMinHash(shingling='buffer', **params)
+            assert buffer_hash.transform(texts) == text_hash.transform(texts)
+
+            text_hash = minhash.KMinHash(**params)
+            buffer_hash = minhash.KMinHash(shingling='buffer', **params)
+            assert buffer_hash.transform(texts) == text_hash.transform(texts)
+
+    text_hash = minhash.KMinHash(seed=seed, method='universal')
+    buffer_hash = minhash.KMinHash(seed=seed, method='universal', shingling='buffer')
+    assert (buffer_hash.transform(texts) == text_hash.transform(texts)).all()
+
+    with pytest.raises(ValueError):
+        minhash.KMinHash(seed=seed, shingling='buffer').transform(['short'])
+
+    with pytest.raises(ValueError):
+        minhash.KMinHash(seed=seed, shingling='rolling')
+
+
+def test_repeated_shingles():
+    repetitive_content = [text + ' ' + content[2] * 20 for text in content]
+    for method in ['multi_hash', 'universal']:
+        multi_hash = minhash.KMinHash(seed=seed, permutations=20, method=method)
+        signatures = np.asarray(multi_hash.transform(repetitive_content))
+
+        for document, signature in zip(multi_hash._k_shingles(repetitive_content), signatures):
+            if method == 'universal':
+                hashes = [multi_hash._hash_unsigned_32(shingle, int(multi_hash.hash_seeds[0])) for shingle in document]
+                expected_signature = [
+                    min((a * hash_value + b) % ((1 << 61) - 1) for hash_value in hashes)
+                    for a, b in zip(multi_hash._coefficients_a.tolist(), multi_hash._coefficients_b.tolist())
+                ]
+            else:
+                expected_signature = [min(multi_hash._hashing(shingle, int(s)) for shingle in document) for s in multi_hash.hash_seeds]
+
+            assert (signature == expected_signature).all()
+
+    bottom_k_hash = minhash.UniMinHash(seed=seed, permutations=20)
+    for document, signature in zip(bottom_k_hash._k_shingles(['ab' * 15]), bottom_k_hash.transform(['ab' * 15])):
+        assert signature == tuple(sorted(bottom_k_hash._hashing(shingle, seed) for shingle in document)[:20])
+        assert len(set(signature)) == 2
+
+    for minhash_class, params in [
+        (minhash.KMinHash, {'method': 'multi_hash'}),
+        (minhash.KMinHash, {'method': 'universal'}),
+        (minhash.UniMinHash, {}),
+        (minhash.OPHMinHash, {})
+    ]:
+        text_hash = minhash_class(seed=seed, permutations=20, **params)
+        buffer_hash = minhash_class(seed=seed, permutations=20, shingling='buffer', **params)
+        assert np.array_equal(
+            np.asarray(buffer_hash.transform(repetitive_content)),
+            np.asarray(text_hash.transform(repetitive_content))
+        )
+
+    windows = next(buffer_hash._k_shingles([content[2] * 20]))
+    assert [bytes(window) for window in windows.unique()] == list(dict.fromkeys(bytes(window) for window in windows))
+
+
+def test_one_permutation_minhash():
+    for hash_size in [32, 64]:
+        one_permutation_hash = minhash.OPHMinHash(seed=seed, permutations=64, n_gram=5, hash_bits=hash_size)
+        signatures = one_permutation_hash.transform(content)
+        assert signatures.shape == (9, 64)
+        assert signatures.dtype == np.uint64
+        assert (minhash.OPHMinHash(seed=seed, permutations=64, n_gram=5, hash_bits=hash_size).transform(content) == signatures).all()
+        assert (one_permutation_hash.transform(content, n_jobs=2, chunk_size=4) == signatures).all()
+
+        shingles = [set(document) for document in one_permutation_hash._k_shingles(content)]
+        for first, second in [(0, 3), (0, 7), (2, 4), (0, 1)]:
+            jaccard = len(shingles[first] & shingles[second]) / len(shingles[first] | shingles[second])
+            assert abs((signatures[first] == signatures[second]).mean() - jaccard) < 0.2
+
+    short_signatures = minhash.OPHMinHash(seed=seed, permutations=64, n_gram=5).transform(['tiny!', 'tiny text'])
+    assert len(set(short_signatures[0].tolist())) == 1
+    assert len(set(short_signatures[1].tolist())) <= 5
+
+    sparse_hash = minhash.OPHMinHash(seed=seed, permutations=64, n_gram=5)
+    sparse_signatures = sparse_hash.transform(['a short text', 'a short text!'])
+    assert (sparse_signatures[0] == sparse_signatures[1]).mean() > 0.5
+
+    with pytest.raises(ValueError):
+        minhash.OPHMinHash(seed=seed, hash_bits=128)